@@ -5,6 +5,13 @@
 #
 # Deformation Profile's main script
 #
+# Command line wrapper over the library modules (see 'dp_api.py' for the
+# in-process API). Importing it has no side effects.
+#
+# Startup budget: printing the usage, showing a pdb file with '-o' (apart
+# from parsing it) or reporting a config error must not import NumPy or
+# Bio.PDB. 'dp_batch' and 'dp_lib' are imported once the input is checked.
+#
 # history:
 #    20090825 - 1.0.0 - JAC - first version
 # --------------------------------------------------------------------
@@ -13,7 +20,6 @@ import os
 import sys
 
 import dp_2d
-import dp_lib
 import dp_match
 import dp_util
 
@@ -26,19 +32,40 @@ class Command:
         
         self.ref_pdb = ("", 0)
         self.cmp_pdbs = []
+        self.cmp_ensemble = ""
+        self.all_vs_all = ""
+        self.manifest = ""
         
         self.alignments = []
         self.squares = []
         
         self.save_matrix = True
         self.save_svg = True
+        self.save_npz = False
+        
+        self.workers = 1
+        self.pipeline = False
+        
+        # 'dp_lib' module parameters, set once the input is checked
+        self.lib_settings = {}
+        
+    def run(self, args):
+        if( not self.parse_input( args ) ):
+            return
         
-    def run(self):
-        self.parse_input()
         self.check_input()
+        self.apply_settings()
+        
+        import dp_batch
 
-        if( not (self.save_matrix or self.save_svg) ):
-            dp_util.Msg.fatal( "Nothing to do!\nCheck 'save_matrix' and 'save_svg' parameters." )
+        # compares the models of 'cmp_model' or 'cmp_list' with each other, no reference
+        if( self.all_vs_all != "" ):
+            fname = os.path.join( self.out_dir, self.all_vs_all )
+            dp_batch.run_all_vs_all( self.alignments, self.squares, self.cmp_pdbs, fname, self.workers )
+            return
+        
+        if( not (self.save_matrix or self.save_svg or self.save_npz) ):
+            dp_util.Msg.fatal( "Nothing to do!\nCheck 'matrix', 'svg' and 'npz' parameters." )
         
         # starts the match class
         match = dp_match.Match( self.alignments )
@@ -47,28 +74,33 @@ class Command:
         dp_util.Msg.out( "opening reference file: '%s'\n" %self.ref_pdb[0] )
         match.set_reference( self.ref_pdb )
         
-        dp = dp_lib.DeformationProfile( match, self.squares )
+        jobs = [(cmp_pdb, self.file_base_name( cmp_pdb[0] )) for cmp_pdb in self.cmp_pdbs]
+        outputs = dp_batch.Outputs( self.save_matrix, self.save_svg, self.save_npz )
         
-        for cmp_pdb in self.cmp_pdbs:
-            # opens comparing model
-            dp_util.Msg.out( "opening comparing file: '%s'\n" %cmp_pdb[0] )
-            set_comparing = match.set_comparing( cmp_pdb )
-            
-            # computes 'deformation profile'
-            dp_util.Msg.out( "comparing models...\n" )
-            
-            match.show( os.path.basename(self.ref_pdb[0]), os.path.basename(cmp_pdb[0]) )
-            dp.compute( )
+        if( self.cmp_ensemble != "" ):
+            dp_batch.compare_ensemble( match, self.squares, self.cmp_ensemble, self.file_base_name( self.cmp_ensemble ) + "_ensemble", outputs )
+        
+        failed = []
+        
+        if( self.manifest != "" ):
+            failed = dp_batch.run_manifest( match, self.squares, jobs, outputs, self.workers, self.manifest )
+        elif( (self.workers > 1) and (len(jobs) > 1) ):
+            failed = dp_batch.run_pool( match, self.squares, jobs, outputs, self.workers )
+        elif( self.pipeline and (len(jobs) > 1) ):
+            failed = dp_batch.run_pipeline( match, self.squares, jobs, outputs )
+        else:
+            dp_batch.run_serial( match, self.squares, jobs, outputs )
+        
+        # the batch went on after the failed models, the run still fails as a serial one does
+        if( len(failed) > 0 ):
+            dp_util.Msg.fatal( "%d of %d models failed" %(len(failed), len(jobs)) )
             
-            # saves a data file
-            if( self.save_matrix ):
-                dp_util.Msg.out( "saving data file...\n" )
-                dp.matrix_save( self.file_base_name( cmp_pdb[0] ) + ".dat" )
-                 
-            # saves an SVG file
-            if( self.save_svg ):
-                dp_util.Msg.out( "saving svg file...\n" )
-                dp.svg_save( self.file_base_name( cmp_pdb[0] ) + ".svg" )
+    # sets the 'dp_lib' parameters read from the config file
+    def apply_settings(self):
+        import dp_lib
+        
+        for (name, value) in self.lib_settings.items():
+            setattr( dp_lib, name, value )
             
     def file_base_name(self, pdb_name ):
         if( self.out_dir != "" ):
@@ -81,22 +113,51 @@ class Command:
 
         return( bname )
 
-    def parse_input( self ):
-        if( len(sys.argv) != 3 ):
+    # returns False when there is nothing to compare
+    def parse_input( self, args ):
+        cli_workers = None
+        
+        # number of worker processes, overrides the config file
+        if( (len(args) > 1) and (args[0] == "-j") ):
+            if( not args[1].isdigit() or int(args[1]) < 1 ):
+                dp_util.Msg.fatal( "Number of workers must be a positive number: '%s'" %args[1] )
+            
+            cli_workers = int( args[1] )
+            args = args[2:]
+            
+        if( len(args) != 2 ):
             dp_util.Msg.usage()
             
-        if( sys.argv[1] == "-c" ):
-            cfg = sys.argv[2]
+        if( args[0] == "-c" ):
+            cfg = args[1]
             
             if( os.path.isfile( cfg ) ):
                 # initializes all config variables
                 out_dir = "."
                 ref_model, cmp_model, cmp_list = "", "", ""
+                cmp_ensemble = ""
+                all_vs_all = ""
+                manifest = ""
                 aligns = []
                 helices, loops, draw = [], [], []
+                dot_bracket, bpseq = "", ""
                 matrix, svg = True, True
+                npz = False
                 quiet_err = False
                 quiet_out = False
+                workers = 1
+                pipeline = False
+                cache_dir = ""
+                result_cache_dir = ""
+                reader = "biopython"
+                svg_matrix = "cells"
+                engine = "numpy"
+                band = None
+                pivots = []
+                sparse_squares = False
+                matrix_dtype = "float64"
+                matrix_dir = ""
+                normalize = False
         
                 #
                 # calls config file
@@ -116,58 +177,100 @@ class Command:
                 if( cmp_list != "" ):
                     self.cmp_pdbs = []
                     self.parse_cmp_list( cmp_list )
+                
+                self.cmp_ensemble = cmp_ensemble
+                self.all_vs_all = all_vs_all
+                self.manifest = manifest
 
-                self.alignment = []
-                for (ref_chain, ref_start, cmp_chain, cmp_start, length) in aligns:
-                    self.alignments.append( dp_match.Alignment(length, ref_chain, ref_start, cmp_chain, cmp_start) )
+                self.alignments = dp_match.make_alignments( aligns )
                     
                 dp_util.Msg.STDERR_QUIET = quiet_err
                 dp_util.Msg.STDOUT_QUIET = quiet_out
                 
-                # secondary structure definition
-                index_aux = {}
+                dp_util.CACHE_DIR = cache_dir
+                self.lib_settings["RESULT_CACHE_DIR"] = result_cache_dir
+                
+                if( reader not in ("biopython", "fast") ):
+                    dp_util.Msg.fatal( "Unknown pdb reader: '%s'\ncheck 'reader' parameter" %reader )
+                
+                dp_util.READER = reader
+                
+                if( svg_matrix not in ("cells", "runs", "image") ):
+                    dp_util.Msg.fatal( "Unknown matrix style: '%s'\ncheck 'svg_matrix' parameter" %svg_matrix )
                 
-                hs = []
-                for (name, first5, length5, first3, length3) in helices:
-                    index_aux[name] = "H"
-                    hs.append( dp_2d.Helix( name, first5, length5, first3, length3 ) )
+                self.lib_settings["MATRIX_STYLE"] = svg_matrix
                 
-                ls = []
-                for (name, first, length) in loops:
-                    index_aux[name] = "L"
-                    ls.append( dp_2d.Loop( name, first, length ) )
+                if( engine not in ("numpy", "pivot") ):
+                    dp_util.Msg.fatal( "Unknown profile engine: '%s'\ncheck 'engine' parameter" %engine )
                 
-                ss = dp_2d.SecondaryStructure( hs, ls )
+                self.lib_settings["ENGINE"] = engine
                 
-                for key in draw:
-                    self.squares.extend( self.parse_draw_key( ss, key, index_aux ) )
+                if( (band != None) and ((not isinstance( band, int )) or (band < 0)) ):
+                    dp_util.Msg.fatal( "Invalid band: '%s'\ncheck 'band' parameter" %str(band) )
+                
+                self.lib_settings["SPARSE_BAND"] = band
+                self.lib_settings["SPARSE_PIVOTS"] = list( pivots )
+                self.lib_settings["SPARSE_SQUARES"] = sparse_squares
+                
+                if( matrix_dtype not in ("float64", "float32") ):
+                    dp_util.Msg.fatal( "Unknown matrix type: '%s'\ncheck 'matrix_dtype' parameter" %matrix_dtype )
+                
+                self.lib_settings["MATRIX_DTYPE"] = matrix_dtype
+                self.lib_settings["MATRIX_DIR"] = matrix_dir
+                
+                self.lib_settings["NORMALIZE"] = bool( normalize )
+                
+                # secondary structure squares
+                self.squares = dp_2d.make_squares( draw, helices, loops, dot_bracket, bpseq )
                 
                 # action
                 self.save_matrix = matrix
                 self.save_svg = svg
+                self.save_npz = npz
+                
+                self.workers = cli_workers or workers
+                self.pipeline = pipeline
             else:
                 dp_util.Msg.fatal( "'%s' file not found\n" %cfg )
-        elif( sys.argv[1] == "-o" ):
-            pdb = sys.argv[2]
+        elif( args[0] == "-o" ):
+            pdb = args[1]
             
             if( os.path.isfile( pdb ) ):
                 dp_util.show_data( pdb )
-                quit()
+                return( False )
             else:
                 dp_util.Msg.fatal( "'%s' file not found\n" %pdb )
         else:
             # minimal usage mode
-            self.ref_pdb = (sys.argv[1], 0)
-            self.cmp_pdbs = [(sys.argv[2], 0)]
+            self.ref_pdb = (args[0], 0)
+            self.cmp_pdbs = [(args[1], 0)]
+            
+            self.workers = cli_workers or 1
+        
+        return( True )
 
     # performs some obvious check in the input
     def check_input(self):
         if( (self.out_dir) != "" and (not os.path.isdir( self.out_dir )) ):
             dp_util.Msg.fatal( "Output directory not found: '%s'\ncheck 'out_dir' parameter" %self.out_dir )
 
-        if( not os.path.isfile( self.ref_pdb[0] ) ):
+        if( (dp_util.CACHE_DIR != "") and (not os.path.isdir( dp_util.CACHE_DIR )) ):
+            dp_util.Msg.fatal( "Cache directory not found: '%s'\ncheck 'cache_dir' parameter" %dp_util.CACHE_DIR )
+
+        result_cache_dir = self.lib_settings.get( "RESULT_CACHE_DIR", "" )
+        if( (result_cache_dir != "") and (not os.path.isdir( result_cache_dir )) ):
+            dp_util.Msg.fatal( "Result cache directory not found: '%s'\ncheck 'result_cache_dir' parameter" %result_cache_dir )
+
+        matrix_dir = self.lib_settings.get( "MATRIX_DIR", "" )
+        if( (matrix_dir != "") and (not os.path.isdir( matrix_dir )) ):
+            dp_util.Msg.fatal( "Matrix directory not found: '%s'\ncheck 'matrix_dir' parameter" %matrix_dir )
+
+        if( (self.all_vs_all == "") and (not os.path.isfile( self.ref_pdb[0] )) ):
             dp_util.Msg.fatal( "Reference file not found: '%s'\ncheck 'ref_model' parameter" %self.ref_pdb[0] )
 
+        if( (self.cmp_ensemble != "") and (not os.path.isfile( self.cmp_ensemble )) ):
+            dp_util.Msg.fatal( "Comparing ensemble not found: '%s'\ncheck 'cmp_ensemble' parameter" %self.cmp_ensemble )
+
         for (fname, model) in self.cmp_pdbs:
             if( not os.path.isfile( fname ) ):
                 dp_util.Msg.fatal( "Comparing file not found: '%s'\ncheck 'cmp_model' or 'cmp_list'  parameter" %fname )
@@ -192,46 +295,24 @@ class Command:
         else:
             dp_util.Msg.fatal( "Comparing list file not found: '%s'\ncheck 'cmp_list' parameter" %cmp_list )
 
-    def parse_draw_key(self, ss, key, index_aux):
-        result = []
-        strip = lambda x: x.strip()
-        
-        name = ""
-        if( ":" in key ):
-            (data, name) = map( strip, key.split( ":" ) )
-        else:
-            data = key
-
-        if( "x" in data ):
-            (s1, s2) = map( strip, data.split( "x" ) )
-            if( index_aux.has_key(s1) and index_aux.has_key(s2) ):
-                sqr_type = index_aux[s1] + index_aux[s2]
-                if( sqr_type == "HH" ):
-                    result = ss.square_hh( s1, s2, name )
-                elif( sqr_type == "LL" ):
-                    result = ss.square_ll( s1, s2, name )
-                elif( sqr_type == "HL" ):
-                    result = ss.square_hl( s1, s2, name )
-                elif( sqr_type == "LH" ):
-                    result = ss.square_lh( s1, s2, name )
-            else:
-                dp_util.Msg.fatal( "Syntax error in draw key: '%s'\ncheck 'draw' parameter" %key )
-        else:
-            s = key.strip()
-            
-            if( index_aux.has_key(s) ):
-                if( index_aux[s] == "H" ):
-                    result = ss.square_helix( s, name )
-                elif( index_aux[s] == "L" ):
-                    result = ss.square_loop( s, name )
-            else:
-                dp_util.Msg.fatal( "Syntax error in draw key: '%s'\ncheck 'draw' parameter" %key )
-        
-        return( result )
-
 
 #
 # MAIN
 #
-cmd = Command()
-cmd.run()
\ No newline at end of file
+def main( args=None ):
+    if( args == None ):
+        args = sys.argv[1:]
+    
+    try:
+        Command().run( args )
+    except dp_util.UsageError:
+        dp_util.Msg.show_usage()
+        return( 1 )
+    except dp_util.FatalError, e:
+        sys.stderr.write( "Fatal Error!\n%s\n" %e )
+        return( 1 )
+    
+    return( 0 )
+
+if( __name__ == "__main__" ):
+    sys.exit( main() )
\ No newline at end of file
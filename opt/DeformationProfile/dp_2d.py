@@ -6,12 +6,27 @@
 # history:
 #    20090825 - 1.0.0 - JAC - first version
 #    20090825 - 1.0.1 - JAC - minor bug corrections
+#    20261018 - 1.1.0 - dot-bracket and BPSEQ importers
 # --------------------------------------------------------------------
 
+import os
+
 import dp_util
 
+E_ = enumerate
+
+# bracket pairs of the extended dot-bracket notation (pseudoknots use the extra brackets and letters)
+BRACKETS = dict( [("(", ")"), ("[", "]"), ("{", "}"), ("<", ">")] +
+                 [(chr(c), chr(c).lower()) for c in xrange( ord("A"), ord("Z") + 1 )] )
+
+# unpaired residues on one strand still considered part of a helix
+MAX_BULGE = 1
+
 class SecondaryStructure:
-    def __init__(self, helices=[], loops=[]):
+    # 'length': number of residues of a whole structure (dot-bracket, BPSEQ), None for single domains
+    def __init__(self, helices=[], loops=[], length=None):
+        self.length = length
+        
         self.helices = {}
         for h in helices:
             self.helices[h.name] = h
@@ -19,6 +34,49 @@ class SecondaryStructure:
         self.loops = {}
         for l in loops:
             self.loops[l.name] = l
+        
+        # domain names, in the given order
+        self.domains = [(h.name, "H") for h in helices] + [(l.name, "L") for l in loops]
+    
+    def from_dot_bracket(structure, first=0):
+        return( SecondaryStructure.from_pairs( pairs_from_dot_bracket( structure ), first ) )
+    
+    def from_bpseq(fname, first=0):
+        return( SecondaryStructure.from_pairs( pairs_from_bpseq( fname ), first ) )
+    
+    def from_pairs(pairs, first=0):
+        (helices, loops) = domains_from_pairs( pairs, first )
+        
+        return( SecondaryStructure( helices, loops, len( pairs ) ) )
+    
+    # one square per domain
+    def domain_squares(self):
+        result = []
+        
+        for (name, kind) in self.domains:
+            if( kind == "H" ):
+                result.extend( self.square_helix( name, "" ) )
+            else:
+                result.extend( self.square_loop( name, "" ) )
+        
+        return( result )
+    
+    # the squares of every pair of different domains
+    def domain_pair_squares(self):
+        result = []
+        
+        for (p, (name1, kind1)) in E_( self.domains ):
+            for (name2, kind2) in self.domains[p+1:]:
+                if( kind1 + kind2 == "HH" ):
+                    result.extend( self.square_hh( name1, name2, "" ) )
+                elif( kind1 + kind2 == "HL" ):
+                    result.extend( self.square_hl( name1, name2, "" ) )
+                elif( kind1 + kind2 == "LH" ):
+                    result.extend( self.square_lh( name1, name2, "" ) )
+                else:
+                    result.extend( self.square_ll( name1, name2, "" ) )
+        
+        return( result )
 
     def square_loop(self, name, square_name=""):
         square_name = (square_name == "" and name) or square_name
@@ -126,7 +184,56 @@ class SecondaryStructure:
         return( result )
 
     def square_lh(self, name1, name2, square_name=None, upper=None):
-        return( self.square( name2, name1, square_name, upper ) )
+        square_name = (square_name == "" and "%s x %s" %(name1, name2)) or square_name
+        
+        return( self.square_hl( name2, name1, square_name, upper ) )
+    
+    # squares of a 'draw' key: "name", "name1 x name2", optionally followed by ": square name",
+    # "*" (every domain) or "* x *" (every pair of domains)
+    def draw_squares(self, key):
+        result = []
+        strip = lambda x: x.strip()
+        
+        # every domain, every pair of domains
+        if( key.strip() == "*" ):
+            return( self.domain_squares() )
+        elif( key.replace( " ", "" ) == "*x*" ):
+            return( self.domain_pair_squares() )
+        
+        index_aux = dict( self.domains )
+        
+        name = ""
+        if( ":" in key ):
+            (data, name) = map( strip, key.split( ":" ) )
+        else:
+            data = key
+
+        if( "x" in data ):
+            (s1, s2) = map( strip, data.split( "x" ) )
+            if( index_aux.has_key(s1) and index_aux.has_key(s2) ):
+                sqr_type = index_aux[s1] + index_aux[s2]
+                if( sqr_type == "HH" ):
+                    result = self.square_hh( s1, s2, name )
+                elif( sqr_type == "LL" ):
+                    result = self.square_ll( s1, s2, name )
+                elif( sqr_type == "HL" ):
+                    result = self.square_hl( s1, s2, name )
+                elif( sqr_type == "LH" ):
+                    result = self.square_lh( s1, s2, name )
+            else:
+                dp_util.Msg.fatal( "Syntax error in draw key: '%s'\ncheck 'draw' parameter" %key )
+        else:
+            s = data.strip()
+            
+            if( index_aux.has_key(s) ):
+                if( index_aux[s] == "H" ):
+                    result = self.square_helix( s, name )
+                elif( index_aux[s] == "L" ):
+                    result = self.square_loop( s, name )
+            else:
+                dp_util.Msg.fatal( "Syntax error in draw key: '%s'\ncheck 'draw' parameter" %key )
+        
+        return( result )
     
     def get_upper(a, b, c, d):
         if( a > b ):
@@ -152,6 +259,9 @@ class SecondaryStructure:
             dp_util.Msg.fatal( "Inverted Square in %s\n(%d, %d) - (%d, %d)" %(err_str, a, b, c, d) )
 
     
+    from_dot_bracket = staticmethod(from_dot_bracket)
+    from_bpseq = staticmethod(from_bpseq)
+    from_pairs = staticmethod(from_pairs)
     check_coords = staticmethod(check_coords)
     get_upper = staticmethod(get_upper)
     get_lower = staticmethod(get_lower)
@@ -169,4 +279,155 @@ class Loop:
     def __init__(self, name, i, n):
         self.name = name
         self.i = i
-        self.n = n
\ No newline at end of file
+        self.n = n
+
+#
+# Base pair tables: 'pairs[i]' is the index of the residue paired with 'i', or -1
+#
+def pairs_from_dot_bracket(structure):
+    closing = dict( [(c, o) for (o, c) in BRACKETS.items()] )
+    stacks = dict( [(o, []) for o in BRACKETS] )
+    
+    pairs = [-1] * len(structure)
+    
+    for (k, ch) in E_( structure ):
+        if( ch in BRACKETS ):
+            stacks[ch].append( k )
+        elif( ch in closing ):
+            if( len( stacks[closing[ch]] ) == 0 ):
+                dp_util.Msg.fatal( "Unbalanced '%s' at position %d in dot-bracket structure" %(ch, k) )
+            
+            i = stacks[closing[ch]].pop()
+            (pairs[i], pairs[k]) = (k, i)
+    
+    for (o, stack) in stacks.items():
+        if( len(stack) > 0 ):
+            dp_util.Msg.fatal( "Unbalanced '%s' at position %d in dot-bracket structure" %(o, stack[-1]) )
+    
+    return( pairs )
+
+def pairs_from_bpseq(fname):
+    entries = []
+    
+    fi = open( fname, "r" )
+    for line in fi:
+        fields = line.split()
+        
+        # skips headers and comments
+        if( (len(fields) != 3) or (not fields[0].isdigit()) ):
+            continue
+        
+        entries.append( (int( fields[0] ), int( fields[2] )) )
+    fi.close()
+    
+    pairs = [-1] * len(entries)
+    
+    for (k, (i, j)) in E_( entries ):
+        if( i != k + 1 ):
+            dp_util.Msg.fatal( "Residue %d out of order in bpseq file '%s'" %(i, fname) )
+        
+        pairs[k] = j - 1
+    
+    return( pairs )
+
+#
+# Splits a base pair table in helices (stacked pairs, allowing bulges of up to MAX_BULGE residues on
+# one strand) and loops (runs of remaining residues). Domains are named H1.. and L1.. from 5' to 3'
+# and their positions are shifted by 'first'. Each residue is visited a constant number of times.
+#
+def domains_from_pairs(pairs, first=0):
+    n = len( pairs )
+    in_helix = [False] * n
+    
+    (helices, loops) = ([], [])
+    
+    k = 0
+    while( k < n ):
+        if( pairs[k] > k and not in_helix[k] ):
+            # outermost pair (i0, j0), extended inwards up to (i1, j1)
+            (i0, j0) = (k, pairs[k])
+            (i1, j1) = (i0, j0)
+            
+            while( True ):
+                p = i1 + 1
+                while( (p < j1) and (pairs[p] == -1) and (p - i1 - 1 < MAX_BULGE) ):
+                    p += 1
+                
+                q = pairs[p]
+                if( (p >= j1) or not (p < q < j1) ):
+                    break
+                
+                (gap5, gap3) = (p - i1 - 1, j1 - q - 1)
+                if( (min( gap5, gap3 ) > 0) or (gap3 > MAX_BULGE) or [r for r in xrange( q + 1, j1 ) if pairs[r] != -1] ):
+                    break
+                
+                (i1, j1) = (p, q)
+            
+            for r in range( i0, i1 + 1 ) + range( j1, j0 + 1 ):
+                in_helix[r] = True
+            
+            helices.append( Helix( "H%d" %(len(helices) + 1), first + i0, i1 - i0 + 1, first + j1, j0 - j1 + 1 ) )
+            k = i1 + 1
+        elif( in_helix[k] or pairs[k] != -1 ):
+            k += 1
+        else:
+            start = k
+            while( (k < n) and (pairs[k] == -1) and not in_helix[k] ):
+                k += 1
+            
+            loops.append( Loop( "L%d" %(len(loops) + 1), first + start, k - start ) )
+    
+    return( helices, loops )
+
+#
+# Secondary structure from the 'dot_bracket', 'bpseq' or 'helices' and 'loops' parameters
+#
+def secondary_structure(helices=[], loops=[], dot_bracket="", bpseq=""):
+    if( dot_bracket != "" ):
+        return( SecondaryStructure.from_dot_bracket( dot_bracket ) )
+    
+    if( bpseq != "" ):
+        if( not os.path.isfile( bpseq ) ):
+            dp_util.Msg.fatal( "BPSEQ file not found: '%s'\ncheck 'bpseq' parameter" %bpseq )
+        
+        return( SecondaryStructure.from_bpseq( bpseq ) )
+    
+    hs = []
+    for (name, first5, length5, first3, length3) in helices:
+        hs.append( Helix( name, first5, length5, first3, length3 ) )
+    
+    ls = []
+    for (name, first, length) in loops:
+        ls.append( Loop( name, first, length ) )
+    
+    return( SecondaryStructure( hs, ls ) )
+
+# squares of the 'draw' keys, the secondary structure is given as in 'secondary_structure'
+def make_squares(draw, helices=[], loops=[], dot_bracket="", bpseq=""):
+    ss = secondary_structure( helices, loops, dot_bracket, bpseq )
+    
+    squares = Squares( [], ss.length )
+    for key in draw:
+        squares.extend( ss.draw_squares( key ) )
+    
+    return( squares )
+
+#
+# List of ((a, b, c, d), name, color) squares, 'length' is the one of the structure they come from
+#
+class Squares( list ):
+    def __init__(self, squares=[], length=None):
+        list.__init__( self, squares )
+        self.length = length
+
+# the squares must lie in the n x n matrix of the aligned residues, and a whole structure must
+# have one residue per aligned residue
+def check_squares(squares, n):
+    length = getattr( squares, "length", None )
+    
+    if( (length != None) and (length != n) ):
+        dp_util.Msg.fatal( "Secondary structure of %d residues, %d residues aligned\ncheck 'dot_bracket' or 'bpseq' parameter" %(length, n) )
+    
+    for ((a, b, c, d), txt, color) in squares:
+        if( (min( a, b ) < 0) or (max( c, d ) >= n) ):
+            dp_util.Msg.fatal( "Square '%s' out of the %d aligned residues\n(%d, %d) - (%d, %d)" %(txt, n, a, b, c, d) )
\ No newline at end of file
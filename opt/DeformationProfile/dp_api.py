@@ -0,0 +1,100 @@
+# --------------------------------------------------------------------
+# dp_api.py
+#
+# In-process Deformation Profile API.
+#
+# 'compare' runs a single comparison and returns a 'ProfileResult'.
+# 'Profiler' keeps the reference model parsed, together with the residue
+# and atom mappings already built, for processes running many
+# comparisons against the same reference. Errors are raised as
+# 'dp_util.FatalError', nothing is read from the command line and no
+# file is written unless asked for.
+#
+# Settings not given as arguments (pdb reader, caches, engine, matrix
+# storage, ...) are the module parameters that 'dp.py' sets from the
+# config file.
+#
+# history:
+#    20261018 - 1.1.0 - first version
+# --------------------------------------------------------------------
+
+import copy
+import os
+
+import dp_2d
+import dp_io
+import dp_lib
+import dp_match
+import dp_util
+
+#
+# Results of one comparison: the 'dp_io.ProfileData' fields plus the computed 'DeformationProfile'
+#
+class ProfileResult( dp_io.ProfileData ):
+    def __init__(self, dp):
+        dp_io.ProfileData.__init__( self )
+        dp_io.from_profile( dp, self )
+
+        self.profile = dp
+
+    def save_dat(self, fname):
+        self.profile.matrix_save( fname )
+
+    def save_npz(self, fname):
+        dp_io.save_data_npz( self, fname )
+
+    def save_svg(self, fname):
+        self.profile.svg_save( fname )
+
+#
+# Comparisons against a single reference model
+#
+class Profiler:
+    # 'ref' as in 'model_spec', 'aligns' as in 'make_alignments' (None: inferred from the sequences),
+    # 'squares' as returned by 'make_squares'
+    def __init__(self, ref, aligns=None, squares=None, atoms=None):
+        self.squares = squares or []
+
+        self.match = dp_match.Match( make_alignments( aligns ), atoms )
+        self.match.set_reference_model( *load_model( ref, self.match.atoms ) )
+
+    # 'squares' replaces the squares of the Profiler for this comparison
+    def compare(self, cmp, normalize=None, squares=None):
+        if( squares == None ):
+            squares = self.squares
+
+        self.match.set_comparing_model( *load_model( cmp, self.match.atoms ) )
+
+        # the result keeps its own view of the match, later comparisons do not change it
+        dp = dp_lib.DeformationProfile( copy.copy( self.match ), squares )
+        dp.compute( None, normalize )
+
+        return( ProfileResult( dp ) )
+
+def compare( ref, cmp, aligns=None, squares=None, normalize=None ):
+    return( Profiler( ref, aligns, squares ).compare( cmp, normalize ) )
+
+# "file.pdb" (first model) or ("file.pdb", model number)
+def model_spec( pdb ):
+    if( isinstance( pdb, basestring ) ):
+        pdb = (pdb, 0)
+
+    (fname, model_num) = pdb
+
+    if( not os.path.isfile( fname ) ):
+        dp_util.Msg.fatal( "PDB file not found: '%s'" %fname )
+
+    return( (fname, int( model_num )) )
+
+# (pdb file, model number, parsed model)
+def load_model( pdb, atoms=None ):
+    (fname, model_num) = model_spec( pdb )
+
+    model = dp_util.get_model( fname, model_num, atoms )
+
+    return( (fname, model_num, model) )
+
+# inputs built from the same values as the config file parameters
+make_alignments = dp_match.make_alignments
+secondary_structure = dp_2d.secondary_structure
+make_squares = dp_2d.make_squares
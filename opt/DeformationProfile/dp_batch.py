@@ -0,0 +1,510 @@
+# --------------------------------------------------------------------
+# dp_batch.py
+#
+# Batch execution of comparisons against a single reference model, and
+# all-vs-all comparison of a list of models.
+#
+# history:
+#    20261018 - 1.1.0 - first version
+# --------------------------------------------------------------------
+
+import copy
+import hashlib
+import itertools
+import multiprocessing
+import os
+import Queue
+import sys
+import threading
+import traceback
+
+import dp_io
+import dp_lib
+import dp_match
+import dp_util
+import numpy as np
+
+#
+# Output settings shared by all comparisons of a batch
+#
+class Outputs:
+    def __init__(self, save_matrix=True, save_svg=True, save_npz=False):
+        self.save_matrix = save_matrix
+        self.save_svg = save_svg
+        self.save_npz = save_npz
+
+#
+# Compares one model against the reference already loaded in 'match' and writes its output files.
+#
+def compare( match, squares, cmp_pdb, base_name, outputs ):
+    # opens comparing model
+    dp_util.Msg.out( "opening comparing file: '%s'\n" %cmp_pdb[0] )
+    match.set_comparing( cmp_pdb )
+
+    # computes 'deformation profile'
+    dp_util.Msg.out( "comparing models...\n" )
+
+    match.show( os.path.basename(match.ref_pdb), os.path.basename(cmp_pdb[0]) )
+
+    dp = dp_lib.DeformationProfile( match, squares )
+    dp.compute( )
+
+    # saves a data file
+    if( outputs.save_matrix ):
+        dp_util.Msg.out( "saving data file...\n" )
+        dp.matrix_save( base_name + ".dat" )
+
+    # saves a binary data file
+    if( outputs.save_npz ):
+        dp_util.Msg.out( "saving npz file...\n" )
+        dp.npz_save( base_name + ".npz" )
+
+    # saves an SVG file
+    if( outputs.save_svg ):
+        dp_util.Msg.out( "saving svg file...\n" )
+        dp.svg_save( base_name + ".svg" )
+
+#
+# Compares every model of 'cmp_file' against the reference. The file is parsed once and the residue
+# and atom mapping of its first model is used for all of them.
+#
+def compare_ensemble( match, squares, cmp_file, base_name, outputs ):
+    dp_util.Msg.out( "opening comparing ensemble: '%s'\n" %cmp_file )
+    models = dp_util.get_models( cmp_file, match.atoms )
+    
+    if( len(models) == 0 ):
+        dp_util.Msg.fatal( "No models in pdb file '%s'" %cmp_file )
+    
+    match.set_comparing_model( cmp_file, models[0].get_id(), models[0] )
+    
+    dp_util.Msg.out( "comparing %d models...\n" %len(models) )
+    
+    match.show( os.path.basename(match.ref_pdb), os.path.basename(cmp_file) )
+    
+    ens = dp_lib.EnsembleProfile( match, squares, models )
+    ens.compute( )
+    
+    # the stacked profiles are only saved as binary data
+    dp_util.Msg.out( "saving npz file...\n" )
+    ens.npz_save( base_name + ".npz" )
+    
+    # saves the ensemble curves
+    if( outputs.save_matrix ):
+        dp_util.Msg.out( "saving data file...\n" )
+        ens.curves_save( base_name + ".dat" )
+
+#
+# Runs the comparisons one after another. A fatal error stops the whole batch.
+#
+def run_serial( match, squares, jobs, outputs ):
+    for (cmp_pdb, base_name) in jobs:
+        compare( match, squares, cmp_pdb, base_name, outputs )
+
+#
+# Process pool
+#
+# The reference 'match' is set before the pool starts, so the workers inherit the parsed reference
+# instead of parsing it again. A fatal error only stops the model that raised it.
+#
+_shared = None
+
+def _worker( job ):
+    (match, squares, outputs) = _shared
+    (cmp_pdb, base_name) = job
+
+    try:
+        compare( match, squares, cmp_pdb, base_name, outputs )
+    except dp_util.FatalError, e:
+        sys.stderr.write( "Fatal Error!\n%s\n" %e )
+        return( False )
+    except Exception:
+        sys.stderr.write( "Fatal Error!\n%s\n" %traceback.format_exc() )
+        return( False )
+
+    return( True )
+
+def run_pool( match, squares, jobs, outputs, workers ):
+    global _shared
+    _shared = (match, squares, outputs)
+
+    pool = multiprocessing.Pool( workers )
+
+    try:
+        # results come back in the order of 'jobs'
+        status = pool.map( _worker, jobs, 1 )
+    finally:
+        pool.close()
+        pool.join()
+        _shared = None
+
+    failed = [cmp_pdb for ((cmp_pdb, base_name), ok) in zip( jobs, status ) if not ok]
+
+    for (fname, model) in failed:
+        dp_util.Msg.out( "failed: '%s' (model %d)\n" %(fname, model) )
+
+    dp_util.Msg.out( "%d of %d models compared\n" %(len(jobs) - len(failed), len(jobs)) )
+
+    return( failed )
+
+#
+# Pipelined batch
+#
+# Overlaps the reading of the comparing models, the profile computation and the writing of the output
+# files. PIPELINE_READERS threads parse the upcoming models, the calling thread matches and profiles
+# them and PIPELINE_WRITERS threads save the results. Each stage hands over at most PIPELINE_DEPTH
+# items: a stage waits when the next one falls behind, so memory stays bounded. Output names come from
+# 'jobs' as in 'run_serial'; a fatal error only stops the model that raised it.
+#
+PIPELINE_READERS = 2
+PIPELINE_WRITERS = 2
+PIPELINE_DEPTH = 4
+
+# end of a stage input
+_DONE = None
+
+# message of the exception being handled, as written by '_worker'
+def _error_message():
+    (kind, e) = sys.exc_info()[:2]
+
+    if( issubclass( kind, dp_util.FatalError ) ):
+        return( str( e ) )
+
+    return( traceback.format_exc() )
+
+def _read_stage( match, jobs, parsed ):
+    while( True ):
+        job = jobs.get()
+        if( job is _DONE ):
+            break
+
+        (k, cmp_pdb, base_name) = job
+
+        try:
+            model = dp_util.get_model( cmp_pdb[0], cmp_pdb[1], match.atoms )
+            parsed.put( (k, cmp_pdb, base_name, model, None) )
+        except Exception:
+            parsed.put( (k, cmp_pdb, base_name, None, _error_message()) )
+
+    parsed.put( _DONE )
+
+def _write_stage( outputs, results, status ):
+    while( True ):
+        item = results.get()
+        if( item is _DONE ):
+            break
+
+        (k, cmp_pdb, dp, base_name) = item
+
+        try:
+            if( outputs.save_matrix ):
+                dp.matrix_save( base_name + ".dat" )
+            if( outputs.save_npz ):
+                dp.npz_save( base_name + ".npz" )
+            if( outputs.save_svg ):
+                dp.svg_save( base_name + ".svg" )
+        except Exception:
+            sys.stderr.write( "Fatal Error!\n%s\n" %_error_message() )
+            status[k] = False
+
+def run_pipeline( match, squares, jobs, outputs ):
+    todo = Queue.Queue()
+    parsed = Queue.Queue( PIPELINE_DEPTH )
+    results = Queue.Queue( PIPELINE_DEPTH )
+
+    for (k, (cmp_pdb, base_name)) in enumerate( jobs ):
+        todo.put( (k, cmp_pdb, base_name) )
+
+    readers = [threading.Thread( target=_read_stage, args=(match, todo, parsed) ) for i in xrange( PIPELINE_READERS )]
+    for t in readers:
+        todo.put( _DONE )
+
+    status = [True] * len(jobs)
+    writers = [threading.Thread( target=_write_stage, args=(outputs, results, status) ) for i in xrange( PIPELINE_WRITERS )]
+
+    for t in readers + writers:
+        t.daemon = True
+        t.start()
+
+    # compute stage: every reader ends its output with _DONE
+    running = len(readers)
+    while( running > 0 ):
+        item = parsed.get()
+        if( item is _DONE ):
+            running -= 1
+            continue
+
+        (k, cmp_pdb, base_name, model, error) = item
+
+        if( error != None ):
+            sys.stderr.write( "Fatal Error!\n%s\n" %error )
+            status[k] = False
+            continue
+
+        # progress messages come from this stage only, the other stages are silent
+        dp_util.Msg.out( "opening comparing file: '%s'\n" %cmp_pdb[0] )
+
+        try:
+            match.set_comparing_model( cmp_pdb[0], cmp_pdb[1], model )
+
+            dp_util.Msg.out( "comparing models...\n" )
+            match.show( os.path.basename(match.ref_pdb), os.path.basename(cmp_pdb[0]) )
+
+            # the writers keep their own view of the match, the next model changes it
+            dp = dp_lib.DeformationProfile( copy.copy( match ), squares )
+            dp.compute( )
+
+            results.put( (k, cmp_pdb, dp, base_name) )
+        except Exception:
+            sys.stderr.write( "Fatal Error!\n%s\n" %_error_message() )
+            status[k] = False
+
+    for t in writers:
+        results.put( _DONE )
+    for t in readers + writers:
+        t.join()
+
+    failed = [cmp_pdb for ((cmp_pdb, base_name), ok) in zip( jobs, status ) if not ok]
+
+    for (fname, model) in failed:
+        dp_util.Msg.out( "failed: '%s' (model %d)\n" %(fname, model) )
+
+    dp_util.Msg.out( "%d of %d models compared\n" %(len(jobs) - len(failed), len(jobs)) )
+
+    return( failed )
+
+#
+# Resumable batch
+#
+# A manifest file records the outcome of every comparison, keyed by the content of the reference and
+# comparing files, their model numbers and the settings changing the results. Comparisons recorded as
+# done whose output files still exist are skipped, failed ones are retried. Entries are appended as
+# soon as each comparison ends, so an interrupted run resumes where it stopped.
+#
+MANIFEST_HEADER = "#DP_MANIFEST 1.0"
+
+class Manifest:
+    def __init__(self, fname):
+        self.fname = fname
+        
+        # key => status of the last entry
+        self.status = {}
+        
+        if( os.path.isfile( fname ) ):
+            fi = open( fname, "r" )
+            for line in fi:
+                fields = line.rstrip( "\r\n" ).split( "\t" )
+                
+                # skips the header and lines cut by an interruption
+                if( len(fields) == 5 ):
+                    self.status[fields[0]] = fields[1]
+            fi.close()
+        else:
+            fo = open( fname, "w" )
+            fo.write( MANIFEST_HEADER + "\n" )
+            fo.close()
+    
+    def is_done(self, key, files):
+        return( (self.status.get( key ) == "ok") and all( [os.path.isfile( f ) for f in files] ) )
+    
+    def record(self, key, status, cmp_pdb, base_name):
+        self.status[key] = status
+        
+        fo = open( self.fname, "a" )
+        fo.write( "%s\t%s\t%s\t%d\t%s\n" %(key, status, cmp_pdb[0], cmp_pdb[1], base_name) )
+        fo.close()
+
+def output_files( base_name, outputs ):
+    files = []
+    
+    if( outputs.save_matrix ):
+        files.append( base_name + ".dat" )
+    if( outputs.save_svg ):
+        files.append( base_name + ".svg" )
+    if( outputs.save_npz ):
+        files.append( base_name + ".npz" )
+    
+    return( files )
+
+# every setting that changes the output files
+def config_signature( match, squares, outputs ):
+    alignments = [(a.length, a.ref_chain, a.ref_start, a.cmp_chain, a.cmp_start) for a in match.alignments]
+    
+    return( repr( (alignments, list( match.atoms ), squares, dp_lib.NORMALIZE, dp_lib.MATRIX_STYLE,
+                   dp_lib.SPARSE_BAND, dp_lib.SPARSE_PIVOTS, dp_lib.SPARSE_SQUARES,
+                   dp_lib.MATRIX_DTYPE, dp_lib.ENGINE, dp_util.READER,
+                   outputs.save_matrix, outputs.save_svg, outputs.save_npz) ) )
+
+def job_key( ref_hash, ref_model_id, cmp_pdb, signature ):
+    txt = "%s|%d|%s|%d|%s" %(ref_hash, ref_model_id, dp_util.file_hash( cmp_pdb[0] ), cmp_pdb[1], signature)
+    
+    return( hashlib.sha1( txt ).hexdigest() )
+
+def run_manifest( match, squares, jobs, outputs, workers, fname ):
+    global _shared
+    
+    manifest = Manifest( fname )
+    
+    signature = config_signature( match, squares, outputs )
+    ref_hash = dp_util.file_hash( match.ref_pdb )
+    
+    pending = []
+    for (cmp_pdb, base_name) in jobs:
+        key = job_key( ref_hash, match.ref_model_id, cmp_pdb, signature )
+        
+        if( not manifest.is_done( key, output_files( base_name, outputs ) ) ):
+            pending.append( (cmp_pdb, base_name, key) )
+    
+    dp_util.Msg.out( "%d of %d models already compared\n" %(len(jobs) - len(pending), len(jobs)) )
+    
+    _shared = (match, squares, outputs)
+    pool = None
+    failed = []
+    
+    try:
+        if( (workers > 1) and (len(pending) > 1) ):
+            pool = multiprocessing.Pool( workers )
+            status = pool.imap( _worker, [(cmp_pdb, base_name) for (cmp_pdb, base_name, key) in pending], 1 )
+        else:
+            status = itertools.imap( _worker, [(cmp_pdb, base_name) for (cmp_pdb, base_name, key) in pending] )
+        
+        # each result is recorded as soon as it is available
+        for ((cmp_pdb, base_name, key), ok) in itertools.izip( pending, status ):
+            if( ok ):
+                manifest.record( key, "ok", cmp_pdb, base_name )
+            else:
+                manifest.record( key, "failed", cmp_pdb, base_name )
+                failed.append( cmp_pdb )
+    finally:
+        if( pool != None ):
+            pool.close()
+            pool.join()
+        _shared = None
+    
+    for (fname, model) in failed:
+        dp_util.Msg.out( "failed: '%s' (model %d)\n" %(fname, model) )
+    
+    dp_util.Msg.out( "%d of %d models compared\n" %(len(pending) - len(failed), len(pending)) )
+    
+    return( failed )
+
+#
+# All-vs-all
+#
+# Every model is compared with every other one, keeping only scalar summaries of each profile.
+# Superimposing B on A gives the same profile as A on B when both models have the same topology,
+# every residue and atom is matched with itself and distances are not normalized (normalization
+# uses the reference residues): these pairs are computed only once. The diagonal is always zero.
+#
+def is_symmetric_pair( fingerprint1, fingerprint2, alignments ):
+    if( dp_lib.NORMALIZE or (fingerprint1 != fingerprint2) ):
+        return( False )
+    
+    for align in alignments:
+        if( (align.ref_chain != align.cmp_chain) or (align.ref_start != align.cmp_start) ):
+            return( False )
+    
+    return( True )
+
+#
+# Compares model 'i' (as reference) with the models in 'columns'. Returns [(j, mean, local rmsd mean, square values)...]
+#
+def compare_row( match, squares, models, i, columns ):
+    (pdb, model_num, model) = models[i]
+    match.set_reference_model( pdb, model_num, model )
+    
+    results = []
+    for j in columns:
+        (cmp_pdb, cmp_num, cmp_model) = models[j]
+        match.set_comparing_model( cmp_pdb, cmp_num, cmp_model )
+        
+        dp = dp_lib.DeformationProfile( match, squares )
+        dp.compute( )
+        
+        results.append( (j, dp.matrix.mean(), dp.curve_local_rmsd.mean(), [value for (k, value) in dp.get_square_values()]) )
+    
+    return( results )
+
+def _row_worker( task ):
+    (match, squares, models) = _shared
+    (i, columns) = task
+    
+    try:
+        return( (i, compare_row( match, squares, models, i, columns )) )
+    except dp_util.FatalError, e:
+        sys.stderr.write( "Fatal Error!\n%s\n" %e )
+        return( (i, None) )
+    except Exception:
+        sys.stderr.write( "Fatal Error!\n%s\n" %traceback.format_exc() )
+        return( (i, None) )
+
+def run_all_vs_all( alignments, squares, pdbs, fname, workers ):
+    global _shared
+    
+    match = dp_match.Match( alignments )
+    
+    # each model is parsed once
+    models = []
+    for (pdb, model_num) in pdbs:
+        dp_util.Msg.out( "opening model: '%s' (model %d)\n" %(pdb, model_num) )
+        model = dp_util.get_model( pdb, model_num, match.atoms )
+        models.append( (pdb, model_num, model) )
+    
+    m = len( models )
+    fingerprints = [dp_util.get_fingerprint( model ) for (pdb, model_num, model) in models]
+    
+    symmetric = np.zeros( (m, m), dtype=bool )
+    for i in xrange( m ):
+        for j in xrange( m ):
+            symmetric[i, j] = is_symmetric_pair( fingerprints[i], fingerprints[j], alignments )
+    
+    # one task per reference model
+    tasks = [(i, [j for j in xrange( m ) if (j != i) and ((j > i) or not symmetric[i, j])]) for i in xrange( m )]
+    
+    _shared = (match, squares, models)
+    
+    try:
+        if( (workers > 1) and (m > 1) ):
+            pool = multiprocessing.Pool( workers )
+            try:
+                status = pool.map( _row_worker, tasks, 1 )
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            status = map( _row_worker, tasks )
+    finally:
+        _shared = None
+    
+    names = sorted( set( [name for (box, name, color) in squares] ) )
+    
+    mean = np.zeros( (m, m) )
+    local_rmsd = np.zeros( (m, m) )
+    square_values = np.zeros( (len(names), m, m) )
+    
+    # pairs of failed rows are left as NaN
+    done = np.eye( m, dtype=bool )
+    
+    for (i, results) in status:
+        if( results == None ):
+            dp_util.Msg.out( "failed: '%s' (model %d)\n" %pdbs[i] )
+            continue
+        
+        for (j, pair_mean, pair_rmsd, values) in results:
+            cells = [(i, j)]
+            if( symmetric[i, j] ):
+                cells.append( (j, i) )
+            
+            for (a, b) in cells:
+                mean[a, b] = pair_mean
+                local_rmsd[a, b] = pair_rmsd
+                square_values[:, a, b] = values
+                done[a, b] = True
+    
+    mean[~done] = np.nan
+    local_rmsd[~done] = np.nan
+    square_values[:, ~done] = np.nan
+    
+    dp_util.Msg.out( "%d of %d pairs compared\n" %(done.sum() - m, m * (m - 1)) )
+    dp_util.Msg.out( "saving all-vs-all file...\n" )
+    
+    dp_io.save_all_vs_all( fname, pdbs, names, mean, local_rmsd, square_values, symmetric )
@@ -0,0 +1,451 @@
+# --------------------------------------------------------------------
+# dp_engine.py
+#
+# Vectorized Deformation Profile engine.
+#
+# The matched atoms of a 'Match' are packed once into contiguous (A,3)
+# coordinate arrays. Residue 'i' owns the atoms 'offsets[i]:offsets[i+1]'.
+# All pivot superpositions are then solved at once (batched Kabsch) and
+# the profile rows are obtained with segment reductions.
+#
+# history:
+#    20261018 - 1.1.0 - first version
+# --------------------------------------------------------------------
+
+import copy
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+import dp_util
+
+# maximum number of (pivot, atom) pairs transformed at once
+BLOCK_SIZE = 1 << 21
+
+# maximum number of matrix cells read or written at once by the tiled helpers
+TILE_SIZE = 1 << 20
+
+class PackedAtoms:
+    def __init__(self, match):
+        (ref_coords, cmp_coords, counts) = match.get_atom_coords()
+
+        for i in xrange( len(counts) ):
+            if( counts[i] == 0 ):
+                (rres, cres) = match.get_residues( i )
+                dp_util.Msg.fatal( "No common atoms between reference residue %s:%s and comparing residue %s:%s"
+                                   %(rres.get_parent().id, rres.get_id()[1], cres.get_parent().id, cres.get_id()[1]) )
+
+        self.ref = np.array( ref_coords, dtype=float ).reshape( -1, 3 )
+        self.cmp = np.array( cmp_coords, dtype=float ).reshape( -1, 3 )
+
+        self.counts = np.array( counts, dtype=int )
+        self.offsets = np.zeros( len(counts) + 1, dtype=int )
+        self.offsets[1:] = np.cumsum( self.counts )
+
+        # residue index of each atom
+        self.owner = np.repeat( np.arange( len(counts) ), self.counts )
+
+    def get_length(self):
+        return( len( self.counts ) )
+
+    # hash of the matched coordinates and of their grouping in residues
+    def digest(self):
+        h = hashlib.sha1()
+
+        for values in (self.counts, self.ref, self.cmp):
+            h.update( np.ascontiguousarray( values ).tostring() )
+
+        return( h.hexdigest() )
+
+    # same matched atoms, other comparing coordinates (e.g. another model of an ensemble)
+    def with_comparing(self, cmp_coords):
+        packed = copy.copy( self )
+        packed.cmp = np.array( cmp_coords, dtype=float ).reshape( -1, 3 )
+
+        return( packed )
+
+    def segment_sum(self, values, axis=0):
+        return( np.add.reduceat( values, self.offsets[:-1], axis=axis ) )
+
+    def segment_mean(self, values):
+        return( self.segment_sum( values ) / self.counts[:, None] )
+
+#
+# Kabsch on stacked correlation matrices (n,3,3). Follows Bio.SVDSuperimposer conventions:
+# the comparing coordinates are moved with 'cmp . rot + tran'.
+#
+def kabsch( corr, ref_center, cmp_center ):
+    (u, d, vt) = np.linalg.svd( corr )
+    rot = np.matmul( u, vt )
+
+    # check if we have found a reflection
+    reflect = np.linalg.det( rot ) < 0
+    if( reflect.any() ):
+        vt[reflect, 2] = -vt[reflect, 2]
+        rot[reflect] = np.matmul( u[reflect], vt[reflect] )
+
+    tran = ref_center - np.einsum( "nk,nkl->nl", cmp_center, rot )
+
+    return( rot, tran )
+
+#
+# Batched superposition: for each residue 'i' finds (rot, tran) superimposing the comparing
+# atoms of 'i' on the reference atoms of 'i'.
+#
+def superpose_all( packed ):
+    ref_center = packed.segment_mean( packed.ref )
+    cmp_center = packed.segment_mean( packed.cmp )
+
+    ref = packed.ref - ref_center[packed.owner]
+    cmp = packed.cmp - cmp_center[packed.owner]
+
+    # correlation matrices, one per residue
+    corr = packed.segment_sum( cmp[:, :, None] * ref[:, None, :] )
+
+    return( kabsch( corr, ref_center, cmp_center ) )
+
+#
+# Single residue superposition. Only the packed arrays are read, the models are never modified.
+#
+def superpose( packed, i ):
+    (a, b) = (packed.offsets[i], packed.offsets[i+1])
+
+    ref_center = packed.ref[a:b].mean( axis=0 )
+    cmp_center = packed.cmp[a:b].mean( axis=0 )
+
+    corr = np.dot( (packed.cmp[a:b] - cmp_center).T, packed.ref[a:b] - ref_center )
+
+    (rot, tran) = kabsch( corr[None], ref_center[None], cmp_center[None] )
+
+    return( rot[0], tran[0] )
+
+def residue_centers( packed ):
+    return( packed.segment_mean( packed.ref ) )
+
+#
+# Computes a single profile row superimposing on pivot 'i'. Returns (row, local_rmsd).
+#
+def profile_row( packed, i, centers=None ):
+    (rot, tran) = superpose( packed, i )
+
+    # only the matched atoms are moved
+    sq = ((np.dot( packed.cmp, rot ) + tran - packed.ref) ** 2).sum( axis=1 )
+
+    row = packed.segment_sum( np.sqrt( sq ) ) / packed.counts
+    rms = np.sqrt( sq[packed.offsets[i]:packed.offsets[i+1]].mean() )
+
+    # Distance normalization
+    if( centers is not None ):
+        norm = np.sqrt( ((centers - centers[i]) ** 2).sum( axis=1 ) )
+        norm[i] = 1.0
+        row /= norm
+
+    return( row, rms )
+
+#
+# Computes the full profile. Returns (matrix, local_rmsd). The rows are written block by block
+# into 'out' if given (see 'new_matrix'), otherwise into a new in-memory array.
+#
+def profile( packed, normalize=False, out=None ):
+    n = packed.get_length()
+
+    matrix = out
+    if( matrix is None ):
+        matrix = np.zeros( (n, n) )
+
+    local_rmsd = np.zeros( n )
+
+    (rot, tran) = superpose_all( packed )
+
+    if( normalize ):
+        centers = residue_centers( packed )
+
+    block = max( 1, BLOCK_SIZE // max( 1, len(packed.ref) ) )
+
+    for p0 in xrange( 0, n, block ):
+        p1 = min( n, p0 + block )
+        dp_util.Msg.out( "%sstep: %d of %d" %("\b" * 40, p1-1, n-1) )
+
+        # comparing atoms superimposed on each pivot of the block: (P, A, 3)
+        moved = np.matmul( packed.cmp[None, :, :], rot[p0:p1] ) + tran[p0:p1, None, :]
+
+        diff = moved - packed.ref[None, :, :]
+        sq = np.einsum( "pak,pak->pa", diff, diff )
+
+        # average atom distance per residue
+        rows = packed.segment_sum( np.sqrt( sq ), axis=1 ) / packed.counts[None, :]
+
+        # rmsd of the pivot residue itself
+        pivots = np.arange( p0, p1 )
+        sq_sum = packed.segment_sum( sq, axis=1 )[pivots - p0, pivots]
+        local_rmsd[p0:p1] = np.sqrt( sq_sum / packed.counts[p0:p1] )
+
+        # Distance normalization
+        if( normalize ):
+            norm = np.sqrt( ((centers[p0:p1, None, :] - centers[None, :, :]) ** 2).sum( axis=2 ) )
+            norm[pivots - p0, pivots] = 1.0
+            rows /= norm
+
+        matrix[p0:p1] = rows
+
+    return( matrix, local_rmsd )
+
+#
+# Out-of-core matrices
+#
+# (rows, cols) matrix of 'dtype' filled with zeros. If 'directory' is not "" the matrix is a
+# 'np.memmap' over a temporary file of that directory, so it does not need to fit in memory. The
+# file is unlinked right away: the space is released when the last reference to the map is gone.
+#
+def new_matrix( rows, cols, dtype=float, directory="" ):
+    if( directory == "" ):
+        return( np.zeros( (rows, cols), dtype=dtype ) )
+
+    (fd, fname) = tempfile.mkstemp( prefix="dp_matrix_", suffix=".tmp", dir=directory )
+    try:
+        matrix = np.memmap( fname, dtype=dtype, mode="w+", shape=(max( 1, rows ), max( 1, cols )) )[:rows, :cols]
+    finally:
+        os.close( fd )
+        os.unlink( fname )
+
+    return( matrix )
+
+# number of rows read or written at once
+def tile_rows( cols ):
+    return( max( 1, TILE_SIZE // max( 1, cols ) ) )
+
+#
+# Yields (r0, r1, matrix[r0:r1]) for consecutive row tiles of a matrix.
+#
+def iter_tiles( matrix ):
+    (rows, cols) = matrix.shape
+    step = tile_rows( cols )
+
+    for r0 in xrange( 0, rows, step ):
+        r1 = min( rows, r0 + step )
+        yield( r0, r1, np.asarray( matrix[r0:r1], dtype=float ) )
+
+#
+# Row and column means read tile by tile. Sums are kept in double precision and accumulated in the
+# same order as 'matrix.mean( axis )' would.
+#
+def tiled_means( matrix ):
+    (rows, cols) = matrix.shape
+
+    row_sum = np.zeros( rows )
+    col_sum = np.zeros( cols )
+
+    for (r0, r1, tile) in iter_tiles( matrix ):
+        row_sum[r0:r1] = tile.sum( axis=1 )
+        col_sum = np.add.reduce( np.vstack( (col_sum[None, :], tile) ), axis=0 )
+
+    return( row_sum / max( 1, cols ), col_sum / max( 1, rows ) )
+
+#
+# Sparse profiles
+#
+# Only the cells of the selected columns of each pivot row are computed. 'columns' has one sorted
+# array of column indices per pivot (possibly empty). The local RMSD curve is always complete.
+#
+def select_columns( n, band=None, pivots=[], boxes=[] ):
+    pivots = set( pivots )
+    columns = []
+
+    for i in xrange( n ):
+        if( i in pivots ):
+            columns.append( np.arange( n ) )
+            continue
+
+        parts = []
+
+        # |i - j| <= band
+        if( band != None ):
+            parts.append( np.arange( max( 0, i - band ), min( n, i + band + 1 ) ) )
+
+        # boxes (a, b, c, d) cover the columns 'a..c' of the rows 'b..d'
+        for (a, b, c, d) in boxes:
+            if( b <= i <= d ):
+                parts.append( np.arange( max( 0, a ), min( n, c + 1 ) ) )
+
+        if( len(parts) > 0 ):
+            columns.append( np.unique( np.concatenate( parts ) ) )
+        else:
+            columns.append( np.zeros( 0, dtype=int ) )
+
+    return( columns )
+
+def profile_sparse( packed, columns, normalize=False ):
+    n = packed.get_length()
+
+    (rot, tran) = superpose_all( packed )
+
+    # every residue superimposed on itself
+    moved = np.einsum( "ak,akl->al", packed.cmp, rot[packed.owner] ) + tran[packed.owner]
+    local_rmsd = np.sqrt( packed.segment_mean( ((moved - packed.ref) ** 2).sum( axis=1 )[:, None] )[:, 0] )
+
+    if( normalize ):
+        centers = residue_centers( packed )
+
+    indptr = np.zeros( n + 1, dtype=int )
+    (indices, data) = ([], [])
+
+    for i in xrange( n ):
+        dp_util.Msg.out( "%sstep: %d of %d" %("\b" * 40, i, n-1) )
+
+        cols = columns[i]
+        indptr[i+1] = indptr[i] + len(cols)
+
+        if( len(cols) == 0 ):
+            continue
+
+        # atoms of the selected residues
+        counts = packed.counts[cols]
+        starts = np.zeros( len(cols), dtype=int )
+        starts[1:] = np.cumsum( counts )[:-1]
+        atoms = np.repeat( packed.offsets[cols] - starts, counts ) + np.arange( counts.sum() )
+
+        sq = ((np.dot( packed.cmp[atoms], rot[i] ) + tran[i] - packed.ref[atoms]) ** 2).sum( axis=1 )
+        values = np.add.reduceat( np.sqrt( sq ), starts ) / counts
+
+        # Distance normalization
+        if( normalize ):
+            norm = np.sqrt( ((centers[cols] - centers[i]) ** 2).sum( axis=1 ) )
+            norm[cols == i] = 1.0
+            values /= norm
+
+        indices.append( cols )
+        data.append( values )
+
+    if( len(data) == 0 ):
+        (indices, data) = ([np.zeros( 0, dtype=int )], [np.zeros( 0 )])
+
+    return( SparseProfile( n, indptr, np.concatenate( indices ), np.concatenate( data ) ), local_rmsd )
+
+#
+# Profile matrix storing only the computed cells, by rows: row 'i' has the values 'data[indptr[i]:indptr[i+1]]'
+# in the columns 'indices[indptr[i]:indptr[i+1]]'. Missing cells read as NaN.
+#
+class SparseProfile:
+    def __init__(self, n, indptr, indices, data):
+        self.n = n
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+
+        self.shape = (n, n)
+
+    def __len__(self):
+        return( self.n )
+
+    def get_row(self, i):
+        (p0, p1) = (self.indptr[i], self.indptr[i+1])
+
+        return( self.indices[p0:p1], self.data[p0:p1] )
+
+    # dense row, NaN where not computed
+    def __getitem__(self, i):
+        row = np.empty( self.n )
+        row.fill( np.nan )
+
+        (cols, values) = self.get_row( i )
+        row[cols] = values
+
+        return( row )
+
+    def to_dense(self):
+        return( np.array( [self[i] for i in xrange( self.n )] ).reshape( self.n, self.n ) )
+
+    def get_rows(self):
+        return( np.repeat( np.arange( self.n ), np.diff( self.indptr ) ) )
+
+    # means of the computed cells only (NaN for rows or columns without any)
+    def mean(self, axis=None):
+        if( axis == None ):
+            return( self.data.mean() )
+
+        if( axis == 1 ):
+            keys = self.get_rows()
+        else:
+            keys = self.indices
+
+        total = np.bincount( keys, weights=self.data, minlength=self.n )
+        count = np.bincount( keys, minlength=self.n )
+
+        mean = np.empty( self.n )
+        mean.fill( np.nan )
+        mean[count > 0] = total[count > 0] / count[count > 0]
+
+        return( mean )
+
+    # same interface as 'SummedArea', only the computed cells of each box are counted
+    def box_values(self, box):
+        (a, b, c, d) = box
+        (totals, counts) = (0.0, 0)
+
+        for r in xrange( max( 0, b ), min( self.n, d + 1 ) ):
+            (cols, values) = self.get_row( r )
+            (j0, j1) = np.searchsorted( cols, [a, c + 1] )
+
+            totals += values[j0:j1].sum()
+            counts += j1 - j0
+
+        return( totals, counts )
+
+    def totals(self, boxes):
+        return( np.array( [self.box_values( box )[0] for box in boxes], dtype=float ) )
+
+    def counts(self, boxes):
+        return( np.array( [self.box_values( box )[1] for box in boxes], dtype=int ) )
+
+    def averages(self, boxes):
+        counts = self.counts( boxes ).astype( float )
+        counts[counts == 0] = np.nan
+
+        return( self.totals( boxes ) / counts )
+
+#
+# Summed-area table: the total of any rectangle of 'matrix' in constant time.
+#
+# Boxes follow the squares convention: (a, b, c, d) covers the columns 'a..c' and the rows 'b..d',
+# both included. Parts of a box outside the matrix are ignored, as with slicing.
+#
+class SummedArea:
+    # built tile by tile, 'directory' as in 'new_matrix'
+    def __init__(self, matrix, directory=""):
+        (rows, cols) = matrix.shape
+
+        self.table = new_matrix( rows + 1, cols + 1, float, directory )
+
+        # running column sums carried from one tile to the next
+        acc = np.zeros( cols )
+        for (r0, r1, tile) in iter_tiles( matrix ):
+            part = np.cumsum( np.vstack( (acc[None, :], tile) ), axis=0 )[1:]
+            acc = part[-1]
+
+            self.table[r0+1:r1+1, 1:] = part.cumsum( axis=1 )
+
+    def totals(self, boxes):
+        boxes = np.asarray( boxes, dtype=int ).reshape( -1, 4 )
+        (rows, cols) = (self.table.shape[0] - 1, self.table.shape[1] - 1)
+
+        c0 = np.clip( boxes[:, 0], 0, cols )
+        r0 = np.clip( boxes[:, 1], 0, rows )
+        c1 = np.clip( boxes[:, 2] + 1, c0, cols )
+        r1 = np.clip( boxes[:, 3] + 1, r0, rows )
+
+        t = self.table
+        return( t[r1, c1] - t[r0, c1] - t[r1, c0] + t[r0, c0] )
+
+    def total(self, a, b, c, d):
+        return( self.totals( [(a, b, c, d)] )[0] )
+
+    # number of cells of each box (parts outside the matrix included)
+    def counts(self, boxes):
+        boxes = np.asarray( boxes, dtype=int ).reshape( -1, 4 )
+
+        return( (boxes[:, 2] - boxes[:, 0] + 1) * (boxes[:, 3] - boxes[:, 1] + 1) )
+
+    def averages(self, boxes):
+        return( self.totals( boxes ) / self.counts( boxes ) )
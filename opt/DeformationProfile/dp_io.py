@@ -0,0 +1,441 @@
+# --------------------------------------------------------------------
+# dp_io.py
+#
+# Reading and writing of Deformation Profile results.
+#
+# Two formats are supported:
+#    - "#DP 1.0" text files ('.dat'), written by 'DeformationProfile.matrix_save'
+#    - binary NumPy archives ('.npz'), written by 'save_npz'. Values are
+#      stored at full precision and the archive also keeps the boxes of
+#      every secondary structure square.
+#
+# 'load' reads either of them into a 'ProfileData'. 'DatReader' streams
+# the text files, reading matrix rows only on request.
+#
+# history:
+#    20261018 - 1.1.0 - first version
+# --------------------------------------------------------------------
+
+import os
+import re
+import tempfile
+
+import numpy as np
+
+import dp_engine
+import dp_util
+
+# bump when the layout of the saved arrays changes
+NPZ_VERSION = 1
+
+DAT_HEADER = "#DP 1.0"
+DAT_FOOTER = "#eof"
+
+RESIDUE_RE = re.compile( r"\((.*?):(-?\d+):'(.*?)'\)" )
+SQUARE_RE = re.compile( r"^'(.*)'$" )
+
+#
+# Profile results independent of the format they were read from
+#
+class ProfileData:
+    def __init__(self):
+        self.ref_pdb = ""
+        self.ref_model = 0
+        self.ref_sequence = ""
+        self.ref_residues = []
+
+        self.cmp_pdb = ""
+        self.cmp_model = 0
+        self.cmp_sequence = ""
+        self.cmp_residues = []
+
+        # curves and matrix
+        self.local_rmsd = None
+        self.row_means = None
+        self.col_means = None
+        self.matrix = None
+
+        # [(name, value), ...] sorted by name
+        self.squares = []
+
+        # only in '.npz' files and computed profiles: one (a, b, c, d) box per drawn square, in 'square_names' order
+        self.square_boxes = None
+        self.square_names = []
+
+        self.normalized = None
+
+    def get_length(self):
+        return( len( self.ref_residues ) )
+
+    def get_square(self, name):
+        for (k, value) in self.squares:
+            if( k == name ):
+                return( value )
+
+        raise KeyError( name )
+
+#
+# '.npz' output
+#
+def _residue_arrays( prefix, residues ):
+    return( { prefix + "_chain": np.array( [r[0] for r in residues], dtype="S" ),
+              prefix + "_num": np.array( [r[1] for r in residues], dtype=int ),
+              prefix + "_name": np.array( [r[2] for r in residues], dtype="S" ) } )
+
+#
+# Results of a computed 'DeformationProfile' as a ProfileData. Fills 'pd' if given.
+#
+def from_profile( dp, pd=None ):
+    if( pd == None ):
+        pd = ProfileData()
+
+    match = dp.match
+
+    (rntxt, cntxt) = ("", "")
+    for i in xrange( match.get_length() ):
+        (rname, cname) = match.get_res_names( i )
+        rntxt += rname
+        cntxt += cname
+
+    (pd.ref_pdb, pd.ref_model, pd.ref_sequence) = (match.ref_pdb, match.ref_model_id, rntxt)
+    (pd.cmp_pdb, pd.cmp_model, pd.cmp_sequence) = (match.cmp_pdb, match.cmp_model_id, cntxt)
+    (pd.ref_residues, pd.cmp_residues) = dp.get_residues_info()
+
+    pd.local_rmsd = dp.curve_local_rmsd
+    pd.row_means = dp.curve_row_mean
+    pd.col_means = dp.curve_col_mean
+    pd.matrix = dp.matrix
+
+    pd.squares = dp.get_square_values()
+    pd.square_names = [str(s[6]) for s in dp.ss_squares_data]
+    pd.square_boxes = np.array( [s[0:4] for s in dp.ss_squares_data], dtype=int ).reshape( -1, 4 )
+
+    pd.normalized = dp.normalized
+
+    return( pd )
+
+def save_npz( dp, fname ):
+    save_data_npz( from_profile( dp ), fname )
+
+def save_data_npz( pd, fname ):
+    boxes = pd.square_boxes
+    if( boxes is None ):
+        boxes = np.zeros( (0, 4), dtype=int )
+
+    arrays = { "version": np.array( NPZ_VERSION ),
+               "normalized": np.array( pd.normalized ),
+               "ref_pdb": np.array( pd.ref_pdb ),
+               "ref_model": np.array( pd.ref_model ),
+               "ref_sequence": np.array( pd.ref_sequence ),
+               "cmp_pdb": np.array( pd.cmp_pdb ),
+               "cmp_model": np.array( pd.cmp_model ),
+               "cmp_sequence": np.array( pd.cmp_sequence ),
+               "local_rmsd": np.asarray( pd.local_rmsd ),
+               "row_means": np.asarray( pd.row_means ),
+               "col_means": np.asarray( pd.col_means ),
+               "square_keys": np.array( [str(k) for (k, value) in pd.squares], dtype="S" ),
+               "square_values": np.array( [value for (k, value) in pd.squares], dtype=float ),
+               "square_names": np.array( pd.square_names, dtype="S" ),
+               "square_boxes": np.asarray( boxes, dtype=int ).reshape( -1, 4 ) }
+
+    arrays.update( _residue_arrays( "ref", pd.ref_residues ) )
+    arrays.update( _residue_arrays( "cmp", pd.cmp_residues ) )
+
+    # sparse profiles keep only the computed cells (row offsets, columns and values)
+    if( isinstance( pd.matrix, dp_engine.SparseProfile ) ):
+        arrays["matrix_indptr"] = pd.matrix.indptr
+        arrays["matrix_indices"] = pd.matrix.indices
+        arrays["matrix_data"] = pd.matrix.data
+    else:
+        arrays["matrix"] = np.asarray( pd.matrix )
+
+    fo = open( fname, "wb" )
+    np.savez( fo, **arrays )
+    fo.close()
+
+#
+# Ensemble '.npz' output: the profiles of every model stacked along the first axis
+#
+def save_ensemble_npz( ens, fname ):
+    match = ens.match
+
+    names = sorted( set( [k for values in ens.square_values for (k, value) in values] ) )
+    squares = np.array( [[dict( values ).get( k, np.nan ) for k in names] for values in ens.square_values], dtype=float )
+
+    arrays = { "version": np.array( NPZ_VERSION ),
+               "normalized": np.array( ens.normalized ),
+               "ref_pdb": np.array( match.ref_pdb ),
+               "ref_model": np.array( match.ref_model_id ),
+               "cmp_pdb": np.array( match.cmp_pdb ),
+               "cmp_models": ens.model_ids,
+               "matrices": ens.matrices,
+               "local_rmsd": ens.local_rmsd,
+               "row_means": ens.row_means,
+               "col_means": ens.col_means,
+               "square_keys": np.array( [str(k) for k in names], dtype="S" ),
+               "square_values": squares.reshape( len(ens.model_ids), len(names) ) }
+
+    # ensemble curves
+    for name in ("local_rmsd", "row_means", "col_means"):
+        arrays[name + "_mean"] = arrays[name].mean( axis=0 )
+        arrays[name + "_std"] = arrays[name].std( axis=0 )
+
+    (ref_info, cmp_info) = ens.get_residues_info()
+    arrays.update( _residue_arrays( "ref", ref_info ) )
+    arrays.update( _residue_arrays( "cmp", cmp_info ) )
+
+    fo = open( fname, "wb" )
+    np.savez( fo, **arrays )
+    fo.close()
+
+#
+# All-vs-all '.npz' output: one (M,M) summary per value, row 'i' uses model 'i' as reference
+#
+def save_all_vs_all( fname, pdbs, square_names, mean, local_rmsd, square_values, symmetric ):
+    arrays = { "version": np.array( NPZ_VERSION ),
+               "pdbs": np.array( [pdb for (pdb, model_num) in pdbs], dtype="S" ),
+               "models": np.array( [model_num for (pdb, model_num) in pdbs], dtype=int ),
+               "mean": mean,
+               "local_rmsd": local_rmsd,
+               "square_keys": np.array( [str(k) for k in square_names], dtype="S" ),
+               "square_values": square_values,
+               "symmetric": symmetric }
+
+    fo = open( fname, "wb" )
+    np.savez( fo, **arrays )
+    fo.close()
+
+#
+# Loaders
+#
+def load_npz( fname ):
+    data = np.load( fname )
+
+    if( int( data["version"] ) != NPZ_VERSION ):
+        raise ValueError( "'%s': unsupported profile version %d" %(fname, int( data["version"] )) )
+
+    pd = ProfileData()
+
+    for prefix in ("ref", "cmp"):
+        setattr( pd, prefix + "_pdb", str( data[prefix + "_pdb"] ) )
+        setattr( pd, prefix + "_model", int( data[prefix + "_model"] ) )
+        setattr( pd, prefix + "_sequence", str( data[prefix + "_sequence"] ) )
+        setattr( pd, prefix + "_residues", zip( [str(c) for c in data[prefix + "_chain"]],
+                                                [int(n) for n in data[prefix + "_num"]],
+                                                [str(r) for r in data[prefix + "_name"]] ) )
+
+    pd.local_rmsd = data["local_rmsd"]
+    pd.row_means = data["row_means"]
+    pd.col_means = data["col_means"]
+    if( "matrix" in data.files ):
+        pd.matrix = data["matrix"]
+    else:
+        pd.matrix = dp_engine.SparseProfile( len( pd.local_rmsd ), data["matrix_indptr"], data["matrix_indices"], data["matrix_data"] )
+
+    pd.squares = zip( [str(k) for k in data["square_keys"]], [float(v) for v in data["square_values"]] )
+    pd.square_names = [str(k) for k in data["square_names"]]
+    pd.square_boxes = data["square_boxes"]
+
+    pd.normalized = bool( data["normalized"] )
+
+    return( pd )
+
+def parse_residues( txt ):
+    return( [(chain, int( num ), name) for (chain, num, name) in RESIDUE_RE.findall( txt )] )
+
+def parse_values( txt ):
+    return( np.fromstring( txt, dtype=float, sep="\t" ) )
+
+#
+# Streaming '.dat' reader
+#
+# The header and the curves are read when the reader is created, the 'ROW_i' block is only read
+# on request: a whole row at a time, either in file order ('iter_rows') or by index ('get_row',
+# which indexes the byte offset of every row on first use).
+#
+class DatReader:
+    def __init__(self, fname):
+        self.fname = fname
+        self.data = ProfileData()
+
+        self.rows_start = 0
+        self.row_offsets = None
+
+        self.fi = open( fname, "rb" )
+
+        try:
+            self.read_header()
+        except:
+            self.fi.close()
+            raise
+
+    def read_header(self):
+        pd = self.data
+
+        if( self.fi.readline().rstrip( "\r\n" ) != DAT_HEADER ):
+            raise ValueError( "'%s': not a Deformation Profile data file" %self.fname )
+
+        while( True ):
+            pos = self.fi.tell()
+            line = self.fi.readline().rstrip( "\r\n" )
+
+            if( line == "" or line == DAT_FOOTER ):
+                break
+
+            (key, txt) = (line.split( "\t", 1 ) + [""])[:2]
+
+            if( key == "REF_PDB" ):
+                pd.ref_pdb = txt
+            elif( key == "REF_MODEL" ):
+                pd.ref_model = int( txt )
+            elif( key == "REF_MODEL_SEQUENCE" ):
+                pd.ref_sequence = txt
+            elif( key == "REF_MODEL_RESIDUES" ):
+                pd.ref_residues = parse_residues( txt )
+            elif( key == "CMP_PDB" ):
+                pd.cmp_pdb = txt
+            elif( key == "CMP_MODEL" ):
+                pd.cmp_model = int( txt )
+            elif( key == "CMP_MODEL_SEQUENCE" ):
+                pd.cmp_sequence = txt
+            elif( key == "CMP_MODEL_RESIDUES" ):
+                pd.cmp_residues = parse_residues( txt )
+            elif( key == "LOCAL_RMSD" ):
+                pd.local_rmsd = parse_values( txt )
+            elif( key == "ROW_MEANS" ):
+                pd.row_means = parse_values( txt )
+            elif( key == "COL_MEANS" ):
+                pd.col_means = parse_values( txt )
+            elif( key == "SQUARE_VALUE" ):
+                (name, value) = txt.split( "\t" )
+                pd.squares.append( (SQUARE_RE.sub( r"\1", name ), float( value )) )
+            elif( key.startswith( "ROW_" ) ):
+                break
+            else:
+                dp_util.Msg.out( "'%s': unknown key '%s' ignored\n" %(self.fname, key) )
+
+        # the matrix starts here
+        self.rows_start = pos
+
+    def get_length(self):
+        return( len( self.data.local_rmsd ) )
+
+    def iter_rows(self):
+        self.fi.seek( self.rows_start )
+
+        for line in self.fi:
+            if( not line.startswith( "ROW_" ) ):
+                break
+
+            (key, txt) = line.split( "\t", 1 )
+            yield( (int( key[4:] ), parse_values( txt )) )
+
+    def index_rows(self):
+        self.row_offsets = np.zeros( self.get_length(), dtype=np.int64 )
+
+        self.fi.seek( self.rows_start )
+
+        while( True ):
+            pos = self.fi.tell()
+            line = self.fi.readline()
+
+            if( not line.startswith( "ROW_" ) ):
+                break
+
+            self.row_offsets[int( line[4:line.index( "\t" )] )] = pos
+
+    def get_row(self, i):
+        if( self.row_offsets is None ):
+            self.index_rows()
+
+        self.fi.seek( self.row_offsets[i] )
+
+        return( parse_values( self.fi.readline().split( "\t", 1 )[1] ) )
+
+    def get_matrix(self):
+        n = self.get_length()
+        matrix = np.zeros( (n, n) )
+
+        for (i, row) in self.iter_rows():
+            matrix[i] = row
+
+        return( matrix )
+
+    def close(self):
+        self.fi.close()
+
+def load_dat( fname, mmap=False ):
+    reader = DatReader( fname )
+
+    try:
+        pd = reader.data
+
+        if( mmap ):
+            pd.matrix = load_matrix( fname, reader )
+        else:
+            pd.matrix = reader.get_matrix()
+    finally:
+        reader.close()
+
+    return( pd )
+
+#
+# Matrix cache
+#
+# The matrix of a '.dat' file is converted once to a '.npy' file next to it and then memory
+# mapped. The cache is rebuilt when the '.dat' file is newer than it.
+#
+def matrix_cache_name( fname ):
+    return( fname + ".npy" )
+
+# umask of the process, it can only be read by setting it
+def file_umask():
+    mask = os.umask( 0 )
+    os.umask( mask )
+
+    return( mask )
+
+def convert( fname, reader=None ):
+    cache = matrix_cache_name( fname )
+
+    if( os.path.isfile( cache ) and os.path.getmtime( cache ) >= os.path.getmtime( fname ) ):
+        return( cache )
+
+    if( reader == None ):
+        reader = DatReader( fname )
+        try:
+            matrix = reader.get_matrix()
+        finally:
+            reader.close()
+    else:
+        matrix = reader.get_matrix()
+
+    # written aside and renamed, so concurrent readers never see a partial file
+    (fd, tmp) = tempfile.mkstemp( suffix=".npy", dir=os.path.dirname( os.path.abspath( cache ) ) )
+    fo = os.fdopen( fd, "wb" )
+    np.save( fo, matrix )
+    fo.close()
+
+    # 'mkstemp' creates the file readable by its owner only, the cache is shared as the '.dat' file is
+    os.chmod( tmp, 0666 & ~file_umask() )
+    os.rename( tmp, cache )
+
+    return( cache )
+
+def load_matrix( fname, reader=None ):
+    return( np.load( convert( fname, reader ), mmap_mode="r" ) )
+
+#
+# Reads a '.dat' or a '.npz' profile, the format is detected from the file content.
+# With 'mmap' the matrix of a '.dat' file is memory mapped from its '.npy' cache.
+#
+def load( fname, mmap=False ):
+    fi = open( fname, "rb" )
+    magic = fi.read( 2 )
+    fi.close()
+
+    # '.npz' files are zip archives
+    if( magic == "PK" ):
+        return( load_npz( fname ) )
+
+    return( load_dat( fname, mmap ) )
@@ -7,13 +7,15 @@
 #    20090825 - 1.0.0 - JAC - first version
 # --------------------------------------------------------------------
 
-import copy
+import hashlib
+import os
+import dp_2d
+import dp_engine
+import dp_io
 import dp_util
 import numpy as np
 import svg
 
-from Bio.PDB import *
-
 E_ = enumerate
 X_ = lambda l: xrange( len(l) )
 
@@ -23,10 +25,33 @@ X_ = lambda l: xrange( len(l) )
 
 SQR_SIDE = 16
 
-# distance normalization
-# *** TODO ***: these values must be set in the config file
+# distance normalization: default of 'DeformationProfile.compute', set from the config file
 NORMALIZE = False
 
+# profile engine: "numpy" solves all pivots at once (see 'dp_engine.py'),
+# "pivot" superimposes the matched atoms once per pivot
+ENGINE = "numpy"
+
+# directory where computed profiles are cached ("" for no cache)
+RESULT_CACHE_DIR = ""
+
+# bump when the cached results are not valid anymore
+RESULT_VERSION = 1
+
+# sparse profiles (see 'dp_engine.SparseProfile'): only the cells with |i - j| <= SPARSE_BAND,
+# the whole rows of SPARSE_PIVOTS and, if SPARSE_SQUARES, the cells inside the squares are computed
+SPARSE_BAND = None
+SPARSE_PIVOTS = []
+SPARSE_SQUARES = False
+
+def is_sparse():
+    return( (SPARSE_BAND != None) or (len(SPARSE_PIVOTS) > 0) or SPARSE_SQUARES )
+
+# dense matrices: "float64" or "float32" cells, kept in memory or, if MATRIX_DIR is not "",
+# memory mapped over temporary files of that directory (see 'dp_engine.new_matrix')
+MATRIX_DTYPE = "float64"
+MATRIX_DIR = ""
+
 # palette parameters
 LIMIT_DOWN = 0.75
 
@@ -34,6 +59,13 @@ LIMIT_DOWN = 0.75
 STEPS_DOWN = 10
 STEPS_UP = 10
 
+# matrix drawing: "cells" (one rectangle per cell), "runs" (one rectangle per run of
+# same color cells in a row) or "image" (one embedded indexed color PNG)
+MATRIX_STYLE = "cells"
+
+# cells not computed in sparse profiles (only used by the "image" matrix style, other styles leave them empty)
+COLOR_MISSING = "#E0E0E0"
+
 # curve color parameters
 COLOR_ROW_MEAN = "#00FF00"
 COLOR_COL_MEAN = "#0000FF"
@@ -44,151 +76,326 @@ class DeformationProfile:
         self.match = match
         self.ss_squares = squares
         self.ss_squares_data = []
+        self.summed_area = None
     
-    def compute( self ):
-        self.matrix = []
-        self.curve_row_mean = []
-        self.curve_col_mean = []
-        self.curve_local_rmsd = []
+    # 'packed' may hold the matched atoms already packed (see 'EnsembleProfile'),
+    # 'normalize' overrides NORMALIZE for this profile
+    def compute( self, packed=None, normalize=None ):
+        self.normalized = NORMALIZE
+        if( normalize != None ):
+            self.normalized = normalize
         
-        # build profile
-        for i in xrange( self.match.get_length() ):
-            dp_util.Msg.out( "%sstep: %d of %d" %("\b" * 40, i, self.match.get_length()-1) )
-            
-            # superimposes 'cmp' on 'ref' minimizing RMSD of residue 'i'
-            (ra1, ca1) = self.match.get_atoms( i )
-            
-            sup = Superimposer()
-            sup.set_atoms( ra1, ca1 )
-            sup.apply( self.match.cmp_model.get_atoms() )
-            
-            self.curve_local_rmsd.append( sup.rms )
-            
-            # Distance normalization
-            if( NORMALIZE ):
-                cm1 = self.center_of_mass(ra1) 
-            
-            # for each nucleotide
-            row = []
-            for j in xrange( self.match.get_length() ):
-                dist_count = 0.0
-                dist_sum = 0.0
-                
-                (ra2, ca2) = self.match.get_atoms( j )
-                
-                for k in X_( ra2 ):
-                    dist = ra2[k] - ca2[k]
+        if( packed == None ):
+            packed = dp_engine.PackedAtoms( self.match )
         
-                    dist_count += 1.0
-                    dist_sum += dist
-
-                # append the average distance between all atoms of the given nucleotide
-                # it gives how distant the ref and cmp nucleotides are when aligning the pivot nucleotide
-                
-                # Distance normalization
-                if( NORMALIZE  and (i != j) ):
-                    cm2 = self.center_of_mass(ra2)
-                    
-                    dist_norm = np.sqrt(np.sum((cm1-cm2) **2))
-                    row.append( dist_sum / (dist_count * dist_norm) )
-                else:
-                    row.append( dist_sum / dist_count )
-            
-            self.matrix.append( row )
-            self.curve_row_mean.append( np.mean( row ) )
-
-        # full matrix
-        self.matrix = np.array( self.matrix )
+        dp_2d.check_squares( self.ss_squares, packed.get_length() )
         
-        # compute column mean
-        for c in xrange( self.match.get_length() ):
-            self.curve_col_mean.append( np.mean( self.matrix[:,c] ) )
+        cache_name = None
+        if( RESULT_CACHE_DIR != "" ):
+            cache_name = os.path.join( RESULT_CACHE_DIR, "dp_%s.npz" %self.result_key( packed ) )
+        
+        if( (cache_name != None) and os.path.isfile( cache_name ) ):
+            self.result_load( cache_name )
+        else:
+            if( is_sparse() ):
+                self.compute_sparse( packed )
+            elif( ENGINE == "numpy" ):
+                self.compute_vectorized( packed )
+            else:
+                self.compute_pivots( packed )
             
-        self.curve_row_mean = np.array( self.curve_row_mean )
-        self.curve_col_mean = np.array( self.curve_col_mean )
-        self.curve_local_rmsd = np.array( self.curve_local_rmsd )
+            if( cache_name != None ):
+                self.result_save( cache_name )
+
+        # compute row and column mean
+        if( isinstance( self.matrix, dp_engine.SparseProfile ) ):
+            self.curve_row_mean = self.matrix.mean( axis=1 )
+            self.curve_col_mean = self.matrix.mean( axis=0 )
+        else:
+            (self.curve_row_mean, self.curve_col_mean) = dp_engine.tiled_means( self.matrix )
         
         # get squares data
         self.compute_squares_data()
         
         dp_util.Msg.out( "%sdone\n" %("\b" * 40) )
+
+    # the profile only depends on the matched coordinates and on the computation settings,
+    # not on the residue names or the secondary structure squares
+    def result_key( self, packed ):
+        txt = "%d|%s|%s|%s" %(RESULT_VERSION, packed.digest(), self.normalized, ENGINE)
+        
+        if( is_sparse() ):
+            txt += "|%r" %(self.get_selection( packed.get_length() ),)
+        elif( MATRIX_DTYPE != "float64" ):
+            txt += "|%s" %MATRIX_DTYPE
+        
+        return( hashlib.sha1( txt ).hexdigest() )
     
-    def center_of_mass(self, atoms):
-        result = np.array( [0.0, 0.0, 0.0] )
+    def result_save( self, fname ):
+        # write and rename, other processes may be reading the same entry
+        temp_name = dp_util.temp_name( fname )
+        
+        fo = open( temp_name, "wb" )
+        if( is_sparse() ):
+            np.savez( fo, indptr=self.matrix.indptr, indices=self.matrix.indices, data=self.matrix.data, local_rmsd=self.curve_local_rmsd )
+        else:
+            np.savez( fo, matrix=self.matrix, local_rmsd=self.curve_local_rmsd )
+        fo.close()
         
-        for atom in atoms:
-            result += atom.get_vector().get_array()
+        os.rename( temp_name, fname )
+    
+    def result_load( self, fname ):
+        data = np.load( fname )
+        
+        if( "matrix" in data.files ):
+            matrix = data["matrix"]
+            
+            self.matrix = self.new_matrix( len(matrix) )
+            self.matrix[:] = matrix
+        else:
+            self.matrix = dp_engine.SparseProfile( len( data["indptr"] ) - 1, data["indptr"], data["indices"], data["data"] )
+        
+        self.curve_local_rmsd = data["local_rmsd"]
+    
+    # (band, pivots, boxes) of the cells computed in sparse mode
+    def get_selection( self, n ):
+        boxes = []
+        if( SPARSE_SQUARES ):
+            boxes = [box for (box, txt, color) in self.ss_squares]
+        
+        return( (SPARSE_BAND, sorted( [p for p in SPARSE_PIVOTS if 0 <= p < n] ), boxes) )
+    
+    def compute_sparse( self, packed ):
+        (band, pivots, boxes) = self.get_selection( packed.get_length() )
+        columns = dp_engine.select_columns( packed.get_length(), band, pivots, boxes )
+        
+        (self.matrix, self.curve_local_rmsd) = dp_engine.profile_sparse( packed, columns, self.normalized )
+    
+    # (n, n) matrix filled by the dense engines
+    def new_matrix( self, n ):
+        return( dp_engine.new_matrix( n, n, MATRIX_DTYPE, MATRIX_DIR ) )
+    
+    def compute_vectorized( self, packed ):
+        (self.matrix, self.curve_local_rmsd) = dp_engine.profile( packed, self.normalized, self.new_matrix( packed.get_length() ) )
 
-        return( result / len(atoms) )
+    def compute_pivots( self, packed ):
+        n = packed.get_length()
+        
+        self.matrix = self.new_matrix( n )
+        self.curve_local_rmsd = np.zeros( n )
+        
+        # Distance normalization
+        centers = None
+        if( self.normalized ):
+            centers = dp_engine.residue_centers( packed )
+        
+        # build profile
+        for i in xrange( n ):
+            dp_util.Msg.out( "%sstep: %d of %d" %("\b" * 40, i, n-1) )
+            
+            # superimposes 'cmp' on 'ref' minimizing RMSD of residue 'i'
+            (self.matrix[i], self.curve_local_rmsd[i]) = dp_engine.profile_row( packed, i, centers )
 
     def compute_squares_data(self):
         self.ss_squares_data = []
+        self.summed_area = None
+        
+        if( len(self.ss_squares) == 0 ):
+            return
+        
+        boxes = [box for (box, txt, color) in self.ss_squares]
+        totals = self.get_summed_area().totals( boxes )
+        sizes = self.get_summed_area().counts( boxes )
         
         # squares (r1, c1)-(r2,c2) => (a, b)-(c, d)
-        for ( (a, b, c, d), txt, color) in self.ss_squares:
+        for ( ((a, b, c, d), txt, color), total, size) in zip( self.ss_squares, totals, sizes ):
             width = c - a + 1
             height = d - b + 1
 
-            size = width * height
-            total = self.matrix[b:d+1,a:c+1].sum()
-            avg = total / float(size)
+            # sparse profiles only count the computed cells
+            if( size > 0 ):
+                avg = total / float(size)
+            else:
+                avg = np.nan
             
             self.ss_squares_data.append( (a, b, c, d, width, height, txt, color, avg, total, size) )
+    
+    # built on first use, any rectangle total then costs O(1). Sparse profiles answer the same queries.
+    def get_summed_area(self):
+        if( self.summed_area == None ):
+            if( isinstance( self.matrix, dp_engine.SparseProfile ) ):
+                self.summed_area = self.matrix
+            else:
+                self.summed_area = dp_engine.SummedArea( self.matrix, MATRIX_DIR )
+        
+        return( self.summed_area )
+    
+    # average of the region covering the columns 'a..c' and the rows 'b..d'
+    def region_average(self, a, b, c, d):
+        return( self.get_summed_area().averages( [(a, b, c, d)] )[0] )
+    
+    # averages of a list of (a, b, c, d) regions
+    def region_averages(self, boxes):
+        return( self.get_summed_area().averages( boxes ) )
+    
+    # 'domains' is a list of (name, first, last) residue ranges. Returns the domain names and the
+    # matrix of averages, item [p, q] being the region of rows in domain 'p' and columns in domain 'q'
+    def domain_averages(self, domains):
+        boxes = [(c0, r0, c1, r1) for (rn, r0, r1) in domains for (cn, c0, c1) in domains]
+        
+        averages = self.region_averages( boxes ).reshape( len(domains), len(domains) )
+        
+        return( [name for (name, first, last) in domains], averages )
 
+    # returns the (chain, number, name) of the reference and comparing residues
+    def get_residues_info(self):
+        (ref_info, cmp_info) = ([], [])
+        
+        for i in xrange( self.match.get_length() ):
+            (rres, cres) = self.match.get_residues( i )
+            ref_info.append( (rres.get_parent().id, rres.get_id()[1], rres.get_resname()) )
+            cmp_info.append( (cres.get_parent().id, cres.get_id()[1], cres.get_resname()) )
+        
+        return( ref_info, cmp_info )
+    
+    # returns the sorted list of (square name, average value), squares with the same name are merged
+    def get_square_values(self):
+        data_total = {}
+        data_size = {}
+        for (a, b, c, d, width, height, k, color, avg, total, size) in self.ss_squares_data:
+            data_total[k] = data_total.get( k, 0.0 ) + total
+            data_size[k] = data_size.get( k, 0 ) + size
+        
+        keys = data_total.keys()
+        keys.sort()
+        
+        result = []
+        for k in keys:
+            # squares of sparse profiles may have no computed cells
+            if( data_size[k] > 0 ):
+                result.append( (k, data_total[k]/float(data_size[k])) )
+            else:
+                result.append( (k, np.nan) )
+        
+        return( result )
+    
     def matrix_save(self, fname):
+        fmt = lambda values: "\t".join( ["%.3f" %x for x in values] )
+        
+        fo = open( fname, "w" )
+        
         # write sequence text
-        txt = "#DP 1.0\n"
+        fo.write( "#DP 1.0\n" )
         
         (rntxt, cntxt) = ("", "")
-        (rrtxt, crtxt) = ("", "")
         for i in xrange( self.match.get_length() ):
             (rname, cname) = self.match.get_res_names( i )
             rntxt += rname
             cntxt += cname
-            
-            (rres, cres) = self.match.get_residues( i )
-            rrtxt += "(%s:%s:'%s')" %(rres.get_parent().id, rres.get_id()[1], rres.get_resname())
-            crtxt += "(%s:%s:'%s')" %(cres.get_parent().id, cres.get_id()[1], cres.get_resname())
+        
+        (ref_info, cmp_info) = self.get_residues_info()
+        rrtxt = "".join( ["(%s:%s:'%s')" %r for r in ref_info] )
+        crtxt = "".join( ["(%s:%s:'%s')" %r for r in cmp_info] )
                 
-        txt += "REF_PDB\t%s\nREF_MODEL\t%d\n" %(self.match.ref_pdb, self.match.ref_model_id)
-        txt += "REF_MODEL_SEQUENCE\t%s\n" %rntxt
-        txt += "REF_MODEL_RESIDUES\t%s\n" %rrtxt
+        fo.write( "REF_PDB\t%s\nREF_MODEL\t%d\n" %(self.match.ref_pdb, self.match.ref_model_id) )
+        fo.write( "REF_MODEL_SEQUENCE\t%s\n" %rntxt )
+        fo.write( "REF_MODEL_RESIDUES\t%s\n" %rrtxt )
         
-        txt += "CMP_PDB\t%s\nCMP_MODEL\t%d\n" %(self.match.cmp_pdb, self.match.cmp_model_id)
-        txt += "CMP_MODEL_SEQUENCE\t%s\n" %cntxt
-        txt += "CMP_MODEL_RESIDUES\t%s\n" %crtxt
+        fo.write( "CMP_PDB\t%s\nCMP_MODEL\t%d\n" %(self.match.cmp_pdb, self.match.cmp_model_id) )
+        fo.write( "CMP_MODEL_SEQUENCE\t%s\n" %cntxt )
+        fo.write( "CMP_MODEL_RESIDUES\t%s\n" %crtxt )
         
         # write profiles
-        txt += "LOCAL_RMSD\t%s\n" %("\t".join( map( lambda x: "%.3f" %x, self.curve_local_rmsd ) ))
-        txt += "ROW_MEANS\t%s\n" %("\t".join( map( lambda x: "%.3f" %x, self.curve_row_mean ) ))
-        txt += "COL_MEANS\t%s\n" %("\t".join( map( lambda x: "%.3f" %x, self.curve_col_mean ) ))
+        fo.write( "LOCAL_RMSD\t%s\n" %fmt( self.curve_local_rmsd ) )
+        fo.write( "ROW_MEANS\t%s\n" %fmt( self.curve_row_mean ) )
+        fo.write( "COL_MEANS\t%s\n" %fmt( self.curve_col_mean ) )
         
         # write squares
-        data_total = {}
-        data_size = {}
-        for (a, b, c, d, width, height, k, color, avg, total, size) in self.ss_squares_data:
-            data_total[k] = data_total.get( k, 0.0 ) + total
-            data_size[k] = data_size.get( k, 0 ) + size
+        for (k, value) in self.get_square_values():
+            fo.write( "SQUARE_VALUE\t'%s'\t%.3f\n" %( k, value ) )
         
-        keys = data_total.keys()
-        keys.sort()
-        for k in keys:
-            txt += "SQUARE_VALUE\t'%s'\t%.3f\n" %( k, data_total[k]/float(data_size[k]) )
-        
-        # write matrix
+        # write matrix, one row at a time
         for i in xrange( self.match.get_length() ):
-            txt += "ROW_%d\t%s\n" %(i, "\t".join( map( lambda x: "%.3f" %x, self.matrix[i] ) ))
+            fo.write( "ROW_%d\t%s\n" %(i, fmt( self.matrix[i] )) )
             
-        txt += "#eof"
-        
-        fo = open( fname, "w" )
-        fo.write( txt )
+        fo.write( "#eof" )
         fo.close()
     
+    def npz_save(self, fname):
+        dp_io.save_npz( self, fname )
+    
     def svg_save(self, fname):
         g = Graphics(self, fname, self.ss_squares_data )
         g.draw()
 
+#
+# Profiles of every model of an ensemble (NMR models, trajectory snapshots) against one reference.
+#
+# 'match' must already be set on the first model of 'models'. All models share its residue and
+# atom mapping, only the coordinates of the matched atoms are read from the other models.
+#
+class EnsembleProfile:
+    def __init__(self, match, squares, models ):
+        self.match = match
+        self.ss_squares = squares
+        self.models = models
+    
+    def compute( self, normalize=None ):
+        self.normalized = NORMALIZE
+        if( normalize != None ):
+            self.normalized = normalize
+        
+        packed = dp_engine.PackedAtoms( self.match )
+        
+        (m, n) = (len( self.models ), packed.get_length())
+        
+        self.model_ids = np.array( [model.get_id() for model in self.models], dtype=int )
+        
+        # one entry per model
+        self.matrices = dp_engine.new_matrix( m, n * n, MATRIX_DTYPE, MATRIX_DIR ).reshape( m, n, n )
+        self.local_rmsd = np.zeros( (m, n) )
+        self.row_means = np.zeros( (m, n) )
+        self.col_means = np.zeros( (m, n) )
+        self.square_values = []
+        
+        for (k, model) in E_( self.models ):
+            dp_util.Msg.out( "model %d (%d of %d)\n" %(model.get_id(), k+1, m) )
+            
+            dp = DeformationProfile( self.match, self.ss_squares )
+            dp.compute( packed.with_comparing( self.match.get_comparing_coords( model ) ), self.normalized )
+            
+            if( isinstance( dp.matrix, dp_engine.SparseProfile ) ):
+                self.matrices[k] = dp.matrix.to_dense()
+            else:
+                self.matrices[k] = dp.matrix
+            self.local_rmsd[k] = dp.curve_local_rmsd
+            self.row_means[k] = dp.curve_row_mean
+            self.col_means[k] = dp.curve_col_mean
+            self.square_values.append( dp.get_square_values() )
+    
+    def get_residues_info(self):
+        return( DeformationProfile( self.match, self.ss_squares ).get_residues_info() )
+    
+    def curves_save(self, fname):
+        fmt = lambda values: "\t".join( ["%.3f" %x for x in values] )
+        
+        fo = open( fname, "w" )
+        
+        fo.write( "#DP_ENSEMBLE 1.0\n" )
+        fo.write( "REF_PDB\t%s\nREF_MODEL\t%d\n" %(self.match.ref_pdb, self.match.ref_model_id) )
+        fo.write( "CMP_PDB\t%s\nCMP_MODELS\t%s\n" %(self.match.cmp_pdb, "\t".join( map( str, self.model_ids ) )) )
+        
+        # ensemble mean and standard deviation per residue
+        for (name, curves) in (("LOCAL_RMSD", self.local_rmsd), ("ROW_MEANS", self.row_means), ("COL_MEANS", self.col_means)):
+            fo.write( "%s_MEAN\t%s\n" %(name, fmt( curves.mean( axis=0 ) )) )
+            fo.write( "%s_STD\t%s\n" %(name, fmt( curves.std( axis=0 ) )) )
+        
+        fo.write( "#eof" )
+        fo.close()
+    
+    def npz_save(self, fname):
+        dp_io.save_ensemble_npz( self, fname )
+
 class Palette:
     def __init__(self, limit_down, steps_down, limit_up, steps_up):
         self.limit_down = limit_down
@@ -204,6 +411,10 @@ class Palette:
         # From YELLOW to RED in 'self.steps_up' steps
         for i in xrange(self.steps_up, 0, -1):
             self.colors.append( svg.colorstr( 255, int(float(i)/self.steps_up*255.0), 0 ) )
+        
+        # NaN values (cells not computed)
+        self.missing = len( self.colors )
+        self.colors.append( COLOR_MISSING )
 
     def get_colors(self, value):
         # choose the color
@@ -214,6 +425,23 @@ class Palette:
             
         return( self.colors[ndx] )
 
+    # same as 'get_colors' for a whole array of values
+    def get_colors_index(self, values):
+        values = np.asarray( values, dtype=float )
+        missing = np.isnan( values )
+        values = np.where( missing, 0.0, values )
+        
+        down = np.minimum( (values * float(self.steps_down) / self.limit_down).astype( int ), self.steps_down - 1 )
+        up = self.steps_down + np.minimum( ((values - self.limit_down) * float(self.steps_up) / (self.limit_up-self.limit_down)).astype( int ), self.steps_up-1 )
+        
+        ndx = np.where( values < self.limit_down, down, up )
+        ndx[missing] = self.missing
+        
+        return( ndx )
+    
+    def get_colors_row(self, values):
+        return( [self.colors[ndx] for ndx in self.get_colors_index( values )] )
+
     
 class Graphics:
     def __init__(self, dp, fname, squares):
@@ -230,23 +458,20 @@ class Graphics:
         self.draw_matrix()
         self.draw_secondary_structure()
         
-        self.scene.write_svg( self.fname )
+        self.scene.close()
 
     def prepare_stage(self):
         self.scale_start = (SQR_SIDE, (17 + len(self.dp.matrix)) * SQR_SIDE)
         self.curve_start = (SQR_SIDE, (13 + len(self.dp.matrix)) * SQR_SIDE)
         self.matrix_start = (SQR_SIDE, (1 + len(self.dp.matrix)) * SQR_SIDE)
         
-        self.scene = svg.Scene( (17 + len(self.dp.matrix)) * SQR_SIDE, (2 + len(self.dp.matrix)) * SQR_SIDE )
+        self.scene = svg.StreamScene( self.fname, (17 + len(self.dp.matrix)) * SQR_SIDE, (2 + len(self.dp.matrix)) * SQR_SIDE )
         
     def prepare_palette(self):
-        m = copy.copy( self.dp.matrix )
-        m = np.reshape( m, m.size )
-        m.sort()
-        
         # *** TODO ***: these values must be set in the config file
+        # (m: all matrix values, sorted)
         #self.palette = Palette(m[m.size * LIMIT_DOWN], STEPS_DOWN, m.max(), STEPS_UP)
-        if( NORMALIZE ):
+        if( self.dp.normalized ):
             self.palette = Palette(1.5, STEPS_DOWN, 3, STEPS_UP)
         else:
             self.palette = Palette(30, STEPS_DOWN, 60, STEPS_UP)
@@ -277,7 +502,14 @@ class Graphics:
         
         x1 = len(self.dp.matrix)
         
-        y_max_inc = max( self.dp.curve_row_mean.max(), self.dp.curve_col_mean.max(), self.dp.curve_local_rmsd.max() ) / 10.0
+        # row and column means of sparse profiles are NaN where no cell was computed, whole curves may be
+        values = np.concatenate( (self.dp.curve_row_mean, self.dp.curve_col_mean, self.dp.curve_local_rmsd) )
+        values = values[~np.isnan( values )]
+        
+        y_max_inc = 0.0
+        if( len(values) > 0 ):
+            y_max_inc = values.max() / 10.0
+        
         y_max_inc = ((int(y_max_inc) / 5) + 1) * 5
         
         start = self.coords( 0, 0 )
@@ -312,7 +544,8 @@ class Graphics:
         for i in xrange( 1, x1 ):
             point_1 = self.coords( i * SQR_SIDE + SQR_SIDE / 2, (points[i]/y_max_inc) * SQR_SIDE )
 
-            self.scene.add( svg.Line( point_0, point_1, stroke_color=stroke_color, stroke_width=1 ) )
+            if( not (np.isnan( points[i-1] ) or np.isnan( points[i] )) ):
+                self.scene.add( svg.Line( point_0, point_1, stroke_color=stroke_color, stroke_width=1 ) )
             
             point_0 = point_1
 
@@ -331,10 +564,47 @@ class Graphics:
             self.scene.add( svg.Text( origin, cname ) )
             #self.scene.add( svg.Text( origin, r ) )
             
-            for c in X_(self.dp.matrix):
+            if( MATRIX_STYLE == "runs" ):
+                self.draw_matrix_runs( r )
+            elif( MATRIX_STYLE != "image" ):
+                self.draw_matrix_cells( r )
+        
+        if( MATRIX_STYLE == "image" ):
+            self.draw_matrix_image()
+
+    def draw_matrix_cells(self, r):
+        ndx = self.palette.get_colors_index( self.dp.matrix[r] )
+        
+        for c in X_(self.dp.matrix):
+            if( ndx[c] != self.palette.missing ):
+                color = self.palette.colors[ndx[c]]
                 origin = self.coords( c * SQR_SIDE, (r+1) * SQR_SIDE )
-                color = self.palette.get_colors( self.dp.matrix[r,c] )
                 self.scene.add( svg.Rectangle( origin, SQR_SIDE, SQR_SIDE, color, color, 0) )
+
+    # one rectangle for each run of cells with the same color
+    def draw_matrix_runs(self, r):
+        ndx = self.palette.get_colors_index( self.dp.matrix[r] )
+        
+        starts = np.nonzero( np.diff( ndx ) )[0] + 1
+        starts = np.concatenate( ([0], starts, [len(ndx)]) )
+        
+        for (c0, c1) in zip( starts[:-1], starts[1:] ):
+            if( ndx[c0] == self.palette.missing ):
+                continue
+            
+            color = self.palette.colors[ndx[c0]]
+            origin = self.coords( c0 * SQR_SIDE, (r+1) * SQR_SIDE )
+            self.scene.add( svg.Rectangle( origin, SQR_SIDE, (c1 - c0) * SQR_SIDE, color, color, 0) )
+
+    # the whole matrix as a single indexed color image, one pixel per cell
+    def draw_matrix_image(self):
+        n = len(self.dp.matrix)
+        
+        # image rows go from top to bottom, matrix rows from bottom to top
+        rows = (self.palette.get_colors_index( self.dp.matrix[r] ) for r in xrange( n-1, -1, -1 ))
+        
+        origin = self.coords( 0, n * SQR_SIDE )
+        self.scene.add( svg.Image( origin, n * SQR_SIDE, n * SQR_SIDE, svg.png_data_uri( rows, n, n, self.palette.colors ) ) )
        
     def draw_secondary_structure(self):
         # squares (r1, c1)-(r2,c2) => (a, b)-(c, d)
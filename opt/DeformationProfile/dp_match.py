@@ -29,6 +29,20 @@ class Alignment:
         self.cmp_chain = cmp_chain
         self.cmp_start = cmp_start
 
+# (ref_chain, ref_start, cmp_chain, cmp_start, length) tuples as in the 'aligns' parameter,
+# or Alignment objects
+def make_alignments( aligns ):
+    result = []
+    
+    for align in (aligns or []):
+        if( isinstance( align, Alignment ) ):
+            result.append( align )
+        else:
+            (ref_chain, ref_start, cmp_chain, cmp_start, length) = align
+            result.append( Alignment( length, ref_chain, ref_start, cmp_chain, cmp_start ) )
+    
+    return( result )
+
 class Match:
     def __init__( self, alignments=None, atoms=None ):
         self.alignments = alignments
@@ -38,6 +52,21 @@ class Match:
         else:
             self.atoms = atoms
         
+        # atom name => normalized name
+        self._atom_slots = dict( [(name, NICE_NAME(name)) for name in self.atoms] )
+        
+        # atom names of a (ref, cmp) residue pair => list of (ref, cmp) atom index pairs
+        self._atom_pairs = {}
+        
+        # topology fingerprint of a comparing model => mapping (see 'get_mapping')
+        self._mappings = {}
+        
+        # global atom indices of the matched atoms (only for 'dp_model' models, see 'get_atom_coords')
+        self._ref_index = None
+        self._cmp_index = None
+        self._cmp_fingerprint = None
+        self._cmp_atom_names = []
+        
         self.ref_model = None
         self.cmp_model = None
                 
@@ -75,14 +104,25 @@ class Match:
 
     def set_reference( self, ref_pdb ):
         # opens reference model
-        self.ref_pdb = ref_pdb[0]
-        self.ref_model_id = ref_pdb[1]        
-        self.ref_model = dp_util.get_model( self.ref_pdb, self.ref_model_id )
+        self.set_reference_model( ref_pdb[0], ref_pdb[1], dp_util.get_model( ref_pdb[0], ref_pdb[1], self.atoms ) )
+    
+    # same as 'set_reference' with an already parsed model
+    def set_reference_model( self, ref_pdb, ref_model_id, ref_model ):
+        self.ref_pdb = ref_pdb
+        self.ref_model_id = ref_model_id
+        self.ref_model = ref_model
+        
+        # mappings are only valid for the reference they were built with
+        self._mappings = {}
 
     def set_comparing( self, cmp_pdb ):
-        self.cmp_pdb = cmp_pdb[0]
-        self.cmp_model_id = cmp_pdb[1]        
-        self.cmp_model = dp_util.get_model( self.cmp_pdb, self.cmp_model_id )
+        self.set_comparing_model( cmp_pdb[0], cmp_pdb[1], dp_util.get_model( cmp_pdb[0], cmp_pdb[1], self.atoms ) )
+    
+    # same as 'set_comparing' with an already parsed model
+    def set_comparing_model( self, cmp_pdb, cmp_model_id, cmp_model ):
+        self.cmp_pdb = cmp_pdb
+        self.cmp_model_id = cmp_model_id
+        self.cmp_model = cmp_model
         self.update()
 
     def get_length(self):
@@ -95,12 +135,24 @@ class Match:
         return self._get_generic(ndx, 1)
    
     def get_atoms(self, ndx):
+        # comparing atoms of a reused mapping are only looked up when needed
+        if( self._cmp_list[ndx][2] == None ):
+            res = self._cmp_list[ndx][0]
+            self._cmp_list[ndx][2] = [res[a] for a in self._cmp_atom_names[ndx]]
+        
         return self._get_generic(ndx, 2)
     
     def _get_generic(self, ndx, pos):
         return( self._ref_list[ndx][pos], self._cmp_list[ndx][pos] )
        
     def update( self ):
+        self._cmp_fingerprint = dp_util.get_fingerprint( self.cmp_model )
+        
+        # same chains, residues and atoms as an already matched model
+        if( self._cmp_fingerprint in self._mappings ):
+            self.update_from_mapping( self._mappings[self._cmp_fingerprint] )
+            return
+        
         self._ref_list = []
         self._cmp_list = []
          
@@ -113,6 +165,27 @@ class Match:
             
         # get atoms
         self.update_atoms()
+        
+        self._mappings[self._cmp_fingerprint] = self.get_mapping()
+    
+    # the matching of the current models: reference entries, comparing residue/atom names and
+    # the atom indices (see 'update_index')
+    def get_mapping( self ):
+        cmp_keys = [(res.get_parent().get_id(), res.get_id(), name, [a.get_name() for a in atoms]) for (res, name, atoms) in self._cmp_list]
+        
+        return( (self._ref_list, cmp_keys, self._ref_index, self._cmp_index) )
+    
+    def update_from_mapping( self, mapping ):
+        (ref_list, cmp_keys, self._ref_index, self._cmp_index) = mapping
+        
+        # reference entries are read only, only the comparing residues and atoms are looked up
+        self._ref_list = ref_list
+        self._cmp_list = []
+        self._cmp_atom_names = []
+        
+        for (chain_id, res_id, name, atom_names) in cmp_keys:
+            self._cmp_list.append( [self.cmp_model[chain_id][res_id], name, None] )
+            self._cmp_atom_names.append( atom_names )
             
     def update_from_models(self):
         sa = dp_util.SeqAligner()
@@ -161,24 +234,87 @@ class Match:
 
 
     def get_common_atoms( self, ref_residue, cmp_residue ):        
-        ref_atoms = []
-        cmp_atoms = []
-        
-        ref_atom_names = [a.name for a in ref_residue if a.name in self.atoms]
-        cmp_atom_names = [a.name for a in cmp_residue if a.name in self.atoms]
-        
-        for ra_name in ref_atom_names:
-            for ca_name in cmp_atom_names:
-                if( NICE_NAME(ra_name) == NICE_NAME(ca_name) ):
-                    ref_atoms.append( ref_residue[ra_name] )
-                    cmp_atoms.append( cmp_residue[ca_name] )
-                    break
+        ref_atoms = [a for a in ref_residue if a.name in self._atom_slots]
+        cmp_atoms = [a for a in cmp_residue if a.name in self._atom_slots]
+        
+        # residues with the same names and atoms share the same mapping
+        key = (ref_residue.get_resname(), cmp_residue.get_resname(), tuple( [a.name for a in ref_atoms] ), tuple( [a.name for a in cmp_atoms] ))
+        
+        if( key not in self._atom_pairs ):
+            self._atom_pairs[key] = self.match_atom_names( key[2], key[3] )
+        
+        pairs = self._atom_pairs[key]
+    
+        return( [ref_atoms[i] for (i, j) in pairs], [cmp_atoms[j] for (i, j) in pairs] )
     
-        return( ref_atoms, cmp_atoms )
+    # returns the (ref, cmp) index pairs of the atoms with the same normalized name
+    def match_atom_names( self, ref_names, cmp_names ):
+        cmp_first = {}
+        for (j, name) in E_( cmp_names ):
+            cmp_first.setdefault( self._atom_slots[name], j )
+        
+        pairs = []
+        for (i, name) in E_( ref_names ):
+            if( self._atom_slots[name] in cmp_first ):
+                pairs.append( (i, cmp_first[self._atom_slots[name]]) )
+        
+        return( pairs )
     
     def update_atoms(self):
         for i in X_( self._ref_list ):
             (ref_atoms, cmp_atoms) = self.get_common_atoms( self._ref_list[i][0], self._cmp_list[i][0] )
             
             self._ref_list[i][2] = ref_atoms
-            self._cmp_list[i][2] = cmp_atoms
\ No newline at end of file
+            self._cmp_list[i][2] = cmp_atoms
+        
+        self.update_index()
+    
+    # 'dp_model' atoms know their position in the model arrays, their coordinates can be gathered at once
+    def update_index( self ):
+        import numpy as np
+        
+        self._ref_index = None
+        self._cmp_index = None
+        
+        if( dp_util.is_array_model( self.ref_model ) ):
+            self._ref_index = np.array( [a.ndx for (res, name, atoms) in self._ref_list for a in atoms], dtype=int )
+        
+        if( dp_util.is_array_model( self.cmp_model ) ):
+            self._cmp_index = np.array( [a.ndx for (res, name, atoms) in self._cmp_list for a in atoms], dtype=int )
+    
+    # returns the coordinates of the matched atoms (in 'get_atoms' order) and the number of atoms per residue
+    def get_atom_coords( self ):
+        counts = [len( atoms ) for (res, name, atoms) in self._ref_list]
+        
+        if( self._ref_index is not None ):
+            ref_coords = self.ref_model.data.coord[self._ref_index]
+        else:
+            ref_coords = [a.get_coord() for (res, name, atoms) in self._ref_list for a in atoms]
+        
+        if( self._cmp_index is not None ):
+            cmp_coords = self.cmp_model.data.coord[self._cmp_index]
+        else:
+            cmp_coords = [a.get_coord() for i in X_( self._cmp_list ) for a in self.get_atoms( i )[1]]
+        
+        return( ref_coords, cmp_coords, counts )
+
+    # coordinates of the matched comparing atoms, in 'get_atoms' order, read from another model
+    # with the same chains, residues and atom names as the comparing model (e.g. an NMR ensemble)
+    def get_comparing_coords( self, model ):
+        if( (self._cmp_index is not None) and dp_util.is_array_model( model ) and (dp_util.get_fingerprint( model ) == self._cmp_fingerprint) ):
+            return( model.data.coord[self._cmp_index] )
+        
+        coords = []
+        
+        for i in X_( self._cmp_list ):
+            (residue, atoms) = (self._cmp_list[i][0], self.get_atoms( i )[1])
+            chain_id = residue.get_parent().get_id()
+            
+            try:
+                other = model[chain_id][residue.get_id()]
+                coords.extend( [other[a.get_name()].get_coord() for a in atoms] )
+            except KeyError:
+                dp_util.Msg.fatal( "Model '%s' doesn't match the residues of model '%s' (residue %s:%s)"
+                                   %(model.get_id(), self.cmp_model.get_id(), chain_id, residue.get_id()[1]) )
+        
+        return( coords )
\ No newline at end of file
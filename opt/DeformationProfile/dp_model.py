@@ -0,0 +1,244 @@
+# --------------------------------------------------------------------
+# dp_model.py
+#
+# Compact array representation of a PDB model.
+#
+# 'ModelData' keeps one model as flat arrays: one entry per residue
+# (chain, id, name, first atom) and one entry per atom (name, xyz).
+# 'Model', 'Chain', 'Residue' and 'Atom' are light views over these
+# arrays implementing the part of the Bio.PDB interface used by the
+# Deformation Profile classes.
+#
+# history:
+#    20261018 - 1.1.0 - first version
+# --------------------------------------------------------------------
+
+import hashlib
+
+import numpy as np
+
+# bump when the layout of the saved arrays changes
+DATA_VERSION = 1
+
+class ModelData:
+    FIELDS = ["res_chain", "res_het", "res_seq", "res_icode", "res_name", "res_start", "atom_name", "coord"]
+
+    def __init__(self, model_id, res_chain, res_het, res_seq, res_icode, res_name, res_start, atom_name, coord):
+        self.model_id = model_id
+
+        # one entry per residue ('res_start' has an extra closing offset)
+        self.res_chain = res_chain
+        self.res_het = res_het
+        self.res_seq = res_seq
+        self.res_icode = res_icode
+        self.res_name = res_name
+        self.res_start = res_start
+
+        # one entry per atom
+        self.atom_name = atom_name
+        self.coord = coord
+
+    def get_model(self):
+        return( Model( self ) )
+
+    # hash of everything but the coordinates: models with the same chains, residues and atoms share it
+    def fingerprint(self):
+        h = hashlib.sha1()
+
+        for f in [f for f in ModelData.FIELDS if f != "coord"]:
+            h.update( np.ascontiguousarray( getattr( self, f ) ).tostring() )
+
+        return( h.hexdigest() )
+
+    def save(self, fname):
+        arrays = dict( [(f, getattr( self, f )) for f in ModelData.FIELDS] )
+        arrays["model_id"] = np.array( self.model_id )
+        arrays["version"] = np.array( DATA_VERSION )
+
+        fo = open( fname, "wb" )
+        np.savez( fo, **arrays )
+        fo.close()
+
+    def load(fname):
+        data = np.load( fname )
+
+        if( int( data["version"] ) != DATA_VERSION ):
+            return( None )
+
+        args = [data[f] for f in ModelData.FIELDS]
+
+        return( ModelData( int( data["model_id"] ), *args ) )
+
+    def from_lists(model_id, residues, atom_names, coords):
+        # residues: [(chain, hetflag, seq, icode, name, first atom), ...]
+        res_start = np.array( [r[5] for r in residues] + [len(atom_names)], dtype=int )
+
+        return( ModelData( model_id,
+                           np.array( [r[0] for r in residues], dtype="S1" ),
+                           np.array( [r[1] for r in residues], dtype="S8" ),
+                           np.array( [r[2] for r in residues], dtype=int ),
+                           np.array( [r[3] for r in residues], dtype="S1" ),
+                           np.array( [r[4] for r in residues], dtype="S4" ),
+                           res_start,
+                           np.array( atom_names, dtype="S4" ),
+                           np.array( coords, dtype="f" ).reshape( -1, 3 ) ) )
+
+    def from_bio(model):
+        residues = []
+        atom_names = []
+        coords = []
+
+        for chain in model:
+            for residue in chain:
+                (het, seq, icode) = residue.get_id()
+                residues.append( (chain.get_id(), het, seq, icode, residue.get_resname(), len(atom_names)) )
+
+                for atom in residue:
+                    atom_names.append( atom.get_name() )
+                    coords.append( atom.get_coord() )
+
+        return( ModelData.from_lists( model.get_id(), residues, atom_names, coords ) )
+
+    load = staticmethod( load )
+    from_lists = staticmethod( from_lists )
+    from_bio = staticmethod( from_bio )
+
+#
+# Light Bio.PDB-like views
+#
+class Atom:
+    def __init__(self, data, ndx, parent):
+        self.ndx = ndx
+        self.name = data.atom_name[ndx]
+        self.coord = data.coord[ndx]
+        self.parent = parent
+
+    def get_name(self):
+        return( self.name )
+
+    def get_id(self):
+        return( self.name )
+
+    def get_coord(self):
+        return( self.coord )
+
+    def get_parent(self):
+        return( self.parent )
+
+    def __sub__(self, other):
+        diff = self.coord - other.coord
+        return( np.sqrt( np.dot( diff, diff ) ) )
+
+class Residue:
+    def __init__(self, data, ndx, parent):
+        self.data = data
+        self.ndx = ndx
+        self.parent = parent
+
+        self.id = (data.res_het[ndx] or " ", int( data.res_seq[ndx] ), data.res_icode[ndx] or " ")
+        self.resname = data.res_name[ndx]
+
+        self._atoms = None
+
+    def get_atoms(self):
+        if( self._atoms == None ):
+            self._atoms = [Atom( self.data, a, self ) for a in xrange( self.data.res_start[self.ndx], self.data.res_start[self.ndx+1] )]
+
+        return( self._atoms )
+
+    def get_id(self):
+        return( self.id )
+
+    def get_resname(self):
+        return( self.resname )
+
+    def get_parent(self):
+        return( self.parent )
+
+    def has_id(self, name):
+        return( name in [a.name for a in self.get_atoms()] )
+
+    def __getitem__(self, name):
+        for a in self.get_atoms():
+            if( a.name == name ):
+                return( a )
+
+        raise KeyError( name )
+
+    def __iter__(self):
+        return( iter( self.get_atoms() ) )
+
+    def __len__(self):
+        return( self.data.res_start[self.ndx+1] - self.data.res_start[self.ndx] )
+
+class Chain:
+    def __init__(self, data, id, ndx_list, parent):
+        self.id = id
+        self.parent = parent
+
+        self.child_list = [Residue( data, r, self ) for r in ndx_list]
+        self.child_dict = dict( [(r.id, r) for r in self.child_list] )
+
+    def _translate_id(self, id):
+        if( isinstance( id, int ) ):
+            return( (" ", id, " ") )
+
+        return( id )
+
+    def get_id(self):
+        return( self.id )
+
+    def get_parent(self):
+        return( self.parent )
+
+    def has_id(self, id):
+        return( self._translate_id( id ) in self.child_dict )
+
+    def __getitem__(self, id):
+        return( self.child_dict[self._translate_id( id )] )
+
+    def __iter__(self):
+        return( iter( self.child_list ) )
+
+    def __len__(self):
+        return( len( self.child_list ) )
+
+class Model:
+    def __init__(self, data):
+        self.data = data
+        self.id = data.model_id
+
+        # chains in order of first appearance
+        order = []
+        residues = {}
+        for r in xrange( len( data.res_chain ) ):
+            c = data.res_chain[r]
+            if( c not in residues ):
+                order.append( c )
+                residues[c] = []
+
+            residues[c].append( r )
+
+        self.child_list = [Chain( data, c, residues[c], self ) for c in order]
+        self.child_dict = dict( [(c.id, c) for c in self.child_list] )
+
+    def get_id(self):
+        return( self.id )
+
+    def has_id(self, id):
+        return( id in self.child_dict )
+
+    def get_atoms(self):
+        for chain in self.child_list:
+            for residue in chain:
+                for atom in residue:
+                    yield atom
+
+    def __getitem__(self, id):
+        return( self.child_dict[id] )
+
+    def __iter__(self):
+        return( iter( self.child_list ) )
+
+    def __len__(self):
+        return( len( self.child_list ) )
@@ -0,0 +1,129 @@
+# --------------------------------------------------------------------
+# dp_pdb.py
+#
+# Minimal PDB reader.
+#
+# Reads only what the Deformation Profile needs from the ATOM/HETATM
+# records (chain, residue id and name, atom name and xyz) straight into
+# 'dp_model.ModelData' arrays. Records are sliced by column with NumPy
+# instead of building one Python object per atom.
+#
+# Differences with Bio.PDB.PDBParser:
+#    - alternate locations: the first one found is kept
+#    - residues are split on every change of residue id, a repeated id
+#      later in the chain is not merged with the first one
+#
+# history:
+#    20261018 - 1.1.0 - first version
+# --------------------------------------------------------------------
+
+import numpy as np
+
+import dp_model
+
+LINE_WIDTH = 54
+
+def _columns( lines, start, end ):
+    width = end - start
+    return( np.ascontiguousarray( lines[:, start:end] ).view( "S%d" %width ).ravel() )
+
+#
+# Converts the atom records of one model into a ModelData.
+#
+def _build( model_id, records, atoms ):
+    if( len( records ) == 0 ):
+        return( dp_model.ModelData.from_lists( model_id, [], [], [] ) )
+
+    lines = np.array( records, dtype="S%d" %LINE_WIDTH ).view( "u1" ).reshape( len(records), LINE_WIDTH )
+
+    names = np.char.strip( _columns( lines, 12, 16 ) )
+    coord = _columns( lines, 30, LINE_WIDTH ).view( "S8" ).reshape( -1, 3 ).astype( float ).astype( "f" )
+
+    # residue boundaries: any change in record type, residue name, chain, number or insertion code
+    res_key = np.ascontiguousarray( np.hstack( (lines[:, 0:1], lines[:, 17:27]) ) ).view( "S11" ).ravel()
+    first = np.ones( len(records), dtype=bool )
+    first[1:] = res_key[1:] != res_key[:-1]
+
+    res_index = np.cumsum( first ) - 1
+
+    keep = np.ones( len(records), dtype=bool )
+
+    # alternate locations, keeps the first one
+    altloc = _columns( lines, 16, 17 )
+    seen = set()
+    for a in np.nonzero( (altloc != " ") & (altloc != "") )[0]:
+        key = (res_index[a], names[a])
+        if( key in seen ):
+            keep[a] = False
+        seen.add( key )
+
+    # atom filter, residues are kept even if none of their atoms is
+    if( atoms != None ):
+        keep &= np.in1d( names, np.array( list( atoms ), dtype="S4" ) )
+
+    starts = np.nonzero( first )[0]
+    res_start = np.zeros( len(starts) + 1, dtype=int )
+    res_start[1:] = np.cumsum( np.bincount( res_index[keep], minlength=len(starts) ) )
+
+    record = _columns( lines, 0, 6 )[starts]
+    res_name = _columns( lines, 17, 20 )[starts]
+
+    # same hetero flags as Bio.PDB
+    res_het = np.where( record == "HETATM", np.char.add( "H_", res_name ), " " ).astype( "S8" )
+    res_het[(record == "HETATM") & ((res_name == "HOH") | (res_name == "WAT"))] = "W"
+
+    return( dp_model.ModelData( model_id,
+                                _columns( lines, 21, 22 )[starts],
+                                res_het,
+                                _columns( lines, 22, 26 )[starts].astype( int ),
+                                _columns( lines, 26, 27 )[starts],
+                                res_name.astype( "S4" ),
+                                res_start,
+                                names[keep].astype( "S4" ),
+                                coord[keep] ) )
+
+#
+# Yields one ModelData per model. Only the models in 'models' are converted (all if None),
+# atoms are restricted to the names in 'atoms' (all if None).
+#
+def iter_models( fname, models=None, atoms=None ):
+    fi = open( fname, "r" )
+
+    model_id = 0
+    records = []
+    in_model = False
+
+    for line in fi:
+        record = line[:6]
+
+        if( record == "ATOM  " or record == "HETATM" ):
+            if( models == None or model_id in models ):
+                records.append( line.rstrip( "\r\n" ) )
+        elif( record == "MODEL " ):
+            in_model = True
+        elif( record == "ENDMDL" ):
+            if( models == None or model_id in models ):
+                yield( _build( model_id, records, atoms ) )
+
+            records = []
+            model_id += 1
+            in_model = False
+
+            # no need to read the rest of the file
+            if( models != None and model_id > max( models ) ):
+                break
+
+    fi.close()
+
+    # last model without ENDMDL, or a file without MODEL records
+    if( len( records ) > 0 or (in_model and (models == None or model_id in models)) ):
+        yield( _build( model_id, records, atoms ) )
+
+def read_models( fname, atoms=None ):
+    return( list( iter_models( fname, None, atoms ) ) )
+
+def read_model( fname, model_num, atoms=None ):
+    for data in iter_models( fname, [model_num], atoms ):
+        return( data )
+
+    return( None )
@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+
+# --------------------------------------------------------------------
+# dp_server.py
+#
+# Local Deformation Profile server.
+#
+# Keeps the reference models parsed (see 'dp_api.Profiler', which also
+# keeps their residue/atom mappings) so that new comparing models are
+# only parsed and profiled. The least recently used references are
+# dropped when more than REF_CACHE_SIZE are loaded; a reference file is
+# parsed again when its modification time changes.
+#
+# Listens on a Unix socket (any address with a '/') or on a localhost
+# TCP port ('host:port'). There is no authentication and the server
+# reads any path given in a request, so only loopback hosts are
+# accepted. Each connection sends one JSON request line:
+#
+#    {"ref": "ref.pdb" or ["ref.pdb", 0], "cmp": "model.pdb" or [...],
+#     "aligns": [[ref_chain, ref_start, cmp_chain, cmp_start, length]],
+#     "draw": [...], "helices": [...], "loops": [...], "dot_bracket": "",
+#     "bpseq": "", "normalize": false, "svg": false}
+#
+# Only "cmp" is required, the other values default to the config file
+# given to the server. Paths are read by the server, relative to its
+# working directory. The answer is streamed as JSON lines:
+#
+#    {"status": "ok", "length": n, "local_rmsd": [...], "row_means": [...],
+#     "col_means": [...], "squares": [[name, value], ...], ...}
+#    {"row": i, "values": [...]}          one per matrix row
+#    {"svg": "..."}                       svg file chunks, if asked for
+#    {"status": "done"}
+#
+# or {"status": "error", "message": "..."}. Every line is strict JSON:
+# cells, means and square values not computed by sparse profiles are
+# sent as null. 'query' is a minimal client.
+#
+# Python 2 has no asyncio: the server is a threading 'SocketServer'.
+# Comparisons against the same reference run one at a time.
+#
+# history:
+#    20261018 - 1.1.0 - first version
+# --------------------------------------------------------------------
+
+import json
+import os
+import signal
+import socket
+import SocketServer
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+import dp
+import dp_2d
+import dp_api
+import dp_match
+import dp_util
+
+# loaded reference models
+REF_CACHE_SIZE = 8
+
+# svg chunk size
+SVG_CHUNK = 1 << 16
+
+#
+# Parsed references, least recently used first
+#
+class ReferenceCache:
+    def __init__(self, size=REF_CACHE_SIZE):
+        self.size = size
+        self.entries = []
+        self.lock = threading.Lock()
+
+        # one lock per reference being parsed, concurrent requests for it wait for the first one
+        self.loading = {}
+
+    # (Profiler, lock) of a reference model with the given alignments
+    def get(self, ref, aligns):
+        (fname, model_num) = dp_api.model_spec( ref )
+        key = (os.path.abspath( fname ), model_num, os.path.getmtime( fname ), repr( aligns ))
+
+        self.lock.acquire()
+        try:
+            value = self.find( key )
+            if( value != None ):
+                return( value )
+
+            loading = self.loading.setdefault( key, threading.Lock() )
+        finally:
+            self.lock.release()
+
+        # parsed outside the cache lock, other references stay available meanwhile
+        loading.acquire()
+        try:
+            self.lock.acquire()
+            try:
+                value = self.find( key )
+            finally:
+                self.lock.release()
+
+            # parsed by the request this one waited for
+            if( value != None ):
+                return( value )
+
+            value = (dp_api.Profiler( (fname, model_num), aligns ), threading.Lock())
+
+            self.lock.acquire()
+            try:
+                self.entries.append( (key, value) )
+                del self.entries[:-self.size]
+                del self.loading[key]
+            finally:
+                self.lock.release()
+        finally:
+            loading.release()
+
+        return( value )
+
+    # moves the entry of 'key' to the most recently used end, the cache lock must be held
+    def find(self, key):
+        for entry in self.entries:
+            if( entry[0] == key ):
+                self.entries.remove( entry )
+                self.entries.append( entry )
+                return( entry[1] )
+
+        return( None )
+
+# JSON has no NaN: cells and means not computed (sparse profiles) are sent as null
+def number( x ):
+    x = float( x )
+    if( x != x ):
+        return( None )
+
+    return( x )
+
+def floats( values ):
+    return( [number( x ) for x in values] )
+
+class Handler( SocketServer.StreamRequestHandler ):
+    def handle(self):
+        try:
+            request = json.loads( self.rfile.readline() )
+            self.server.compare( request, self.send )
+        except dp_util.FatalError, e:
+            self.send( {"status": "error", "message": str( e )} )
+        except (ValueError, KeyError, TypeError, EnvironmentError), e:
+            self.send( {"status": "error", "message": "%s: %s" %(e.__class__.__name__, e)} )
+        except Exception, e:
+            # unexpected, e.g. a malformed model: the client still gets an answer, the log the traceback
+            sys.stderr.write( traceback.format_exc() )
+            self.send( {"status": "error", "message": "%s: %s" %(e.__class__.__name__, e)} )
+
+    def send(self, obj):
+        # strict JSON, any NaN left is an error here and not in the client
+        self.wfile.write( json.dumps( obj, allow_nan=False ) + "\n" )
+
+class ServerMixIn:
+    def setup_profiles(self, command):
+        self.command = command
+        self.references = ReferenceCache()
+
+    def compare(self, request, send):
+        t0 = time.time()
+        cmd = self.command
+
+        if( "cmp" not in request ):
+            dp_util.Msg.fatal( "Missing 'cmp' in request" )
+
+        ref = request.get( "ref", cmd.ref_pdb )
+
+        aligns = cmd.alignments
+        if( "aligns" in request ):
+            aligns = dp_match.make_alignments( request["aligns"] )
+
+        squares = cmd.squares
+        if( [k for k in ("draw", "helices", "loops", "dot_bracket", "bpseq") if k in request] ):
+            squares = dp_2d.make_squares( request.get( "draw", [] ), request.get( "helices", [] ), request.get( "loops", [] ),
+                                          request.get( "dot_bracket", "" ), request.get( "bpseq", "" ) )
+
+        alignment_key = [(a.ref_chain, a.ref_start, a.cmp_chain, a.cmp_start, a.length) for a in aligns]
+        (profiler, lock) = self.references.get( ref, alignment_key )
+
+        lock.acquire()
+        try:
+            result = profiler.compare( request["cmp"], request.get( "normalize" ), squares )
+        finally:
+            lock.release()
+
+        send( { "status": "ok",
+                "length": result.get_length(),
+                "ref_pdb": result.ref_pdb, "ref_model": result.ref_model, "ref_sequence": result.ref_sequence,
+                "cmp_pdb": result.cmp_pdb, "cmp_model": result.cmp_model, "cmp_sequence": result.cmp_sequence,
+                "normalized": bool( result.normalized ),
+                "local_rmsd": floats( result.local_rmsd ),
+                "row_means": floats( result.row_means ),
+                "col_means": floats( result.col_means ),
+                "squares": [(k, number( value )) for (k, value) in result.squares],
+                "time": time.time() - t0 } )
+
+        for i in xrange( result.get_length() ):
+            send( {"row": i, "values": floats( result.matrix[i] )} )
+
+        if( request.get( "svg", False ) ):
+            (fd, fname) = tempfile.mkstemp( prefix="dp_server_", suffix=".svg" )
+            os.close( fd )
+
+            try:
+                result.save_svg( fname )
+
+                fi = open( fname, "r" )
+                for chunk in iter( lambda: fi.read( SVG_CHUNK ), "" ):
+                    send( {"svg": chunk} )
+                fi.close()
+            finally:
+                os.unlink( fname )
+
+        send( {"status": "done"} )
+
+        sys.stderr.write( "%s: %.3f s\n" %(result.cmp_pdb, time.time() - t0) )
+
+class UnixServer( ServerMixIn, SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer ):
+    daemon_threads = True
+
+class TCPServer( ServerMixIn, SocketServer.ThreadingMixIn, SocketServer.TCPServer ):
+    daemon_threads = True
+    allow_reuse_address = True
+
+# "path/to/socket" or "host:port"
+def is_unix_address( address ):
+    return( "/" in address or ":" not in address )
+
+# every address of 'host' is a loopback one
+def is_loopback( host ):
+    try:
+        infos = socket.getaddrinfo( host, None )
+    except socket.gaierror:
+        return( False )
+
+    return( all( [info[4][0].startswith( "127." ) or (info[4][0] == "::1") for info in infos] ) )
+
+def serve( address, command ):
+    if( is_unix_address( address ) ):
+        if( os.path.exists( address ) ):
+            os.unlink( address )
+
+        server = UnixServer( address, Handler )
+    else:
+        (host, port) = address.rsplit( ":", 1 )
+
+        if( not is_loopback( host ) ):
+            dp_util.Msg.fatal( "Not a loopback host: '%s'\nthe server has no authentication, use 'localhost' or a Unix socket" %host )
+
+        server = TCPServer( (host, int( port )), Handler )
+
+    server.setup_profiles( command )
+
+    sys.stderr.write( "listening on '%s'\n" %address )
+
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+        if( is_unix_address( address ) and os.path.exists( address ) ):
+            os.unlink( address )
+
+#
+# Client: sends 'request' (a dict as described above) and returns the answer lines in one dict,
+# the matrix as a list of rows and the svg as a single string
+#
+def query( address, request ):
+    if( is_unix_address( address ) ):
+        sock = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+        sock.connect( address )
+    else:
+        (host, port) = address.rsplit( ":", 1 )
+        sock = socket.create_connection( (host, int( port )) )
+
+    fo = sock.makefile( "rwb" )
+    fo.write( json.dumps( request ) + "\n" )
+    fo.flush()
+
+    answer = {"matrix": [], "svg": ""}
+    svg = []
+
+    for line in fo:
+        obj = json.loads( line )
+
+        if( "row" in obj ):
+            answer["matrix"].append( obj["values"] )
+        elif( "svg" in obj ):
+            svg.append( obj["svg"] )
+        elif( obj.get( "status" ) != "done" ):
+            answer.update( obj )
+
+    fo.close()
+    sock.close()
+
+    answer["svg"] = "".join( svg )
+
+    if( answer.get( "status" ) == "error" ):
+        raise dp_util.FatalError( answer["message"] )
+
+    return( answer )
+
+def usage():
+    cmd = os.path.basename( sys.argv[0] )
+
+    sys.stderr.write( "\nUsage:\n" )
+    sys.stderr.write( "\t%s <socket path | host:port> [<config_file>]\n\n" %cmd )
+
+#
+# MAIN
+#
+def main( args=None ):
+    if( args == None ):
+        args = sys.argv[1:]
+
+    if( len(args) not in (1, 2) ):
+        usage()
+        return( 1 )
+
+    # the config file sets the defaults of the requests (reference, alignments, squares, settings)
+    command = dp.Command()
+
+    try:
+        if( len(args) == 2 ):
+            command.parse_input( ["-c", args[1]] )
+
+        command.apply_settings()
+    except dp_util.FatalError, e:
+        sys.stderr.write( "Fatal Error!\n%s\n" %e )
+        return( 1 )
+
+    # progress messages of concurrent comparisons would be mixed up
+    dp_util.Msg.STDERR_QUIET = True
+
+    # the socket file is removed on 'kill' too
+    signal.signal( signal.SIGTERM, lambda signum, frame: sys.exit( 0 ) )
+
+    try:
+        serve( args[0], command )
+    except KeyboardInterrupt:
+        pass
+    except dp_util.FatalError, e:
+        sys.stderr.write( "Fatal Error!\n%s\n" %e )
+        return( 1 )
+
+    return( 0 )
+
+if( __name__ == "__main__" ):
+    sys.exit( main() )
@@ -7,18 +7,33 @@
 #    20090825 - 1.0.0 - JAC - first version
 # --------------------------------------------------------------------
 
+import hashlib
 import os
 import sys
+import threading
 
-from Bio.PDB import *
+# NumPy, Bio.PDB and the modules built on them ('dp_model', 'dp_pdb') are imported by the
+# functions using them: importing this module, printing the usage or reporting a config error
+# must stay as fast as starting the interpreter.
+
+#
+# Raised by 'Msg.fatal'. The command line reports it and stops, library callers may catch it.
+#
+class FatalError( Exception ):
+    pass
+
+#
+# Raised by 'Msg.usage' on wrong command line arguments, the command line prints the usage
+#
+class UsageError( FatalError ):
+    pass
 
 class Msg:
     STDERR_QUIET = False
     STDOUT_QUIET = False
     
     def fatal( msg ):
-        sys.stderr.write( "Fatal Error!\n%s\n" %msg )
-        quit()
+        raise FatalError( msg )
         
     def out( msg, stderr=True ):
         if( stderr ):
@@ -30,25 +45,32 @@ class Msg:
                 sys.stdout.write( msg )
         
     def usage():
+        raise UsageError( "Wrong number of arguments" )
+        
+    def show_usage():
         cmd = os.path.basename(sys.argv[0])
         
         sys.stderr.write( "\n-------------------\n" )
         sys.stderr.write( "Deformation Profile\n" )
         sys.stderr.write( "-------------------\n" )
         sys.stderr.write( "\nUsage:\n" )
-        sys.stderr.write( "\t%s <reference pdb> <comparing pdb>\n" %cmd )
-        sys.stderr.write( "\t%s -c <config_file>\n" %cmd )
+        sys.stderr.write( "\t%s [-j <workers>] <reference pdb> <comparing pdb>\n" %cmd )
+        sys.stderr.write( "\t%s [-j <workers>] -c <config_file>\n" %cmd )
         sys.stderr.write( "\t%s -o <pdb_file>\n\n" %cmd )
         sys.stderr.write( "For more information see 'dps_manual.pdf'\n\n" )
-        quit()
         
     fatal = staticmethod( fatal )
     out = staticmethod( out )
     usage = staticmethod( usage )
+    show_usage = staticmethod( show_usage )
 
 #
 # This implements a short version of S-W local alignment algorithm to obtain the longest gap-free sequence.
 #
+# The score matrix is swept one row at a time with NumPy, so only two rows are kept. Besides the
+# score, each cell keeps the length of the gap-free run that the traceback would follow from it,
+# which is all that is needed from the best cell.
+#
 class SeqAligner:
     def __init__(self, match=2, miss=-1,indel=-4):
         self._match = match
@@ -61,53 +83,59 @@ class SeqAligner:
         self.bases1 = []
         self.bases2 = []
         
-    def matrix_build( self, s1, s2 ):
-        F = [[0] * (len(s2)+1) for i in xrange(len(s1)+1)]
-      
-        max_coords = (0, 0)
-        for i in xrange(1, len(s1)+1):
-            for j in xrange(1, len(s2)+1):
-                if( s1[i-1] == s2[j-1] ):
-                    score = self._match
-                else:
-                    score = self._miss
-                     
-                choice0 = 0
-                choice1 = F[i-1][j-1] + score
-                choice2 = F[i-1][j] + self._indel
-                choice3 = F[i][j-1] + self._indel
-                
-                F[i][j] = max( choice1, choice2, choice3 )
-                
-                if( F[max_coords[0]][max_coords[1]] < F[i][j] ):
-                    max_coords = (i, j)
-        
-        return (F, max_coords)
-    
-    def align( self, s1, s2 ):
-        self.length = 0
-        self.start1 = 0
-        self.start2 = 0
-        self.bases1 = []
-        self.bases2 = []
+    def scan( self, s1, s2 ):
+        import numpy as np
+        
+        if( len(s1) == 0 or len(s2) == 0 ):
+            return( 0, 0, 0 )
+        
+        # residue names => integer codes
+        codes = {}
+        c1 = np.array( [codes.setdefault( x, len(codes) ) for x in s1], dtype=int )
+        c2 = np.array( [codes.setdefault( x, len(codes) ) for x in s2], dtype=int )
         
-        (F, (mi, mj)) = self.matrix_build( s1, s2 )
+        m = len(s2)
+        steps = np.arange( m + 1 ) * self._indel
         
-        i = mi
-        j = mj
+        F = np.zeros( m + 1, dtype=int )
+        run = np.zeros( m + 1, dtype=int )
+        
+        (best, mi, mj, mrun) = (0, 0, 0, 0)
+        for i in xrange( 1, len(s1)+1 ):
+            score = np.where( c2 == c1[i-1], self._match, self._miss )
+            
+            # best of diagonal and vertical moves
+            D = np.zeros( m + 1, dtype=int )
+            D[1:] = np.maximum( F[:-1] + score, F[1:] + self._indel )
+            
+            # horizontal moves: F[j] = max( D[k] + (j-k)*indel ) for k <= j
+            F_new = np.maximum.accumulate( D - steps ) + steps
+            F_new[0] = 0
+            
+            # gap-free run followed by the traceback from each cell
+            diag = np.zeros( m + 1, dtype=bool )
+            diag[1:] = (F_new[1:] >= F[1:]) & (F_new[1:] >= F_new[:-1])
+            
+            run_new = np.zeros( m + 1, dtype=int )
+            run_new[1:] = np.where( diag[1:], run[:-1] + 1, 0 )
             
-        while (i > 0 and j > 0):
-            if( (F[i][j] >= F[i-1][j]) and (F[i][j] >= F[i][j-1]) ):
-                i -= 1
-                j -= 1
-            else:
-                break
-        
-        self.length = mi-i
-        self.start1 = i
-        self.start2 = j
-        self.bases1 = s1[i:mi]
-        self.bases2 = s2[j:mj]    
+            # first cell (row-major) holding a new maximum
+            j = int( np.argmax( F_new[1:] ) ) + 1
+            if( F_new[j] > best ):
+                (best, mi, mj, mrun) = (F_new[j], i, j, int( run_new[j] ))
+            
+            (F, run) = (F_new, run_new)
+        
+        return( mi, mj, mrun )
+    
+    def align( self, s1, s2 ):
+        (mi, mj, length) = self.scan( s1, s2 )
+        
+        self.length = length
+        self.start1 = mi - length
+        self.start2 = mj - length
+        self.bases1 = s1[self.start1:mi]
+        self.bases2 = s2[self.start2:mj]    
             
             
 #
@@ -116,20 +144,134 @@ class SeqAligner:
 def get_sequence( chain ):
     return( [r.get_resname().strip() for r in chain] )
 
-def get_model( pdb, model_num ):
-    parser = PDBParser()
+def is_array_model( model ):
+    import dp_model
+    
+    return( isinstance( model, dp_model.Model ) )
+
+#
+# Topology fingerprint: chains, residue ids and names and atom names, in file order. Coordinates
+# are not part of it.
+#
+def get_fingerprint( model ):
+    if( is_array_model( model ) ):
+        return( model.data.fingerprint() )
     
-    struct = parser.get_structure( "X", pdb )
+    h = hashlib.sha1()
+    for chain in model:
+        for residue in chain:
+            h.update( "%s|%s|%s|%s\n" %(chain.get_id(), residue.get_id(), residue.get_resname(), " ".join( [a.get_name() for a in residue] )) )
     
-    if( model_num < len( struct ) ):
-        return( struct[model_num] )
+    return( h.hexdigest() )
+
+#
+# PDB reader: "biopython" (Bio.PDB.PDBParser) or "fast" (see 'dp_pdb.py')
+#
+READER = "biopython"
+
+def pdb_parser():
+    from Bio.PDB import PDBParser
+    
+    return( PDBParser() )
+
+def get_model( pdb, model_num, atoms=None ):
+    if( CACHE_DIR != "" ):
+        data = get_cached_data( pdb, model_num )
+    elif( READER == "fast" ):
+        data = read_model_data( pdb, model_num, atoms )
     else:
-        Msg.out( "No model '%d' in pdb file '%s'" %(model_num, pdb) )
+        struct = pdb_parser().get_structure( "X", pdb )
         
-def show_data(pdb):
-    parser = PDBParser()
+        if( model_num < len( struct ) ):
+            return( struct[model_num] )
+        
+        data = None
+    
+    if( data == None ):
+        Msg.fatal( "No model '%d' in pdb file '%s'" %(model_num, pdb) )
+    
+    return( data.get_model() )
+
+# all the models of a pdb file, parsed in one pass ('CACHE_DIR' is not used)
+def get_models( pdb, atoms=None ):
+    if( READER == "fast" ):
+        import dp_pdb
+        
+        try:
+            return( [data.get_model() for data in dp_pdb.iter_models( pdb, None, atoms )] )
+        except ValueError:
+            Msg.fatal( "Invalid atom record in pdb file '%s'" %pdb )
+    
+    return( list( pdb_parser().get_structure( "X", pdb ) ) )
+
+def read_model_data( pdb, model_num, atoms=None ):
+    import dp_model
+    
+    if( READER == "fast" ):
+        import dp_pdb
+        
+        try:
+            return( dp_pdb.read_model( pdb, model_num, atoms ) )
+        except ValueError:
+            Msg.fatal( "Invalid atom record in pdb file '%s'" %pdb )
+    
+    struct = pdb_parser().get_structure( "X", pdb )
+    
+    if( model_num < len( struct ) ):
+        return( dp_model.ModelData.from_bio( struct[model_num] ) )
+
+#
+# Parsed structure cache
+#
+# The residue/atom data of each parsed model is kept in 'CACHE_DIR' as an '.npz' file named after
+# the SHA-1 of the pdb file content, the model number and the 'READER' (the readers may pick
+# different alternate locations). Editing the file changes its hash, so stale entries are simply
+# never read again.
+#
+CACHE_DIR = ""
+
+# temporary name to write 'fname' and then rename it, unique per process and thread
+def temp_name( fname ):
+    return( "%s.%d.%d.tmp" %(fname, os.getpid(), threading.current_thread().ident) )
+
+def file_hash( fname ):
+    h = hashlib.sha1()
+    
+    fi = open( fname, "rb" )
+    for block in iter( lambda: fi.read( 1 << 20 ), "" ):
+        h.update( block )
+    fi.close()
+    
+    return( h.hexdigest() )
+
+def get_cached_data( pdb, model_num ):
+    import dp_model
     
-    struct = parser.get_structure( "X", pdb )
+    cache_name = os.path.join( CACHE_DIR, "%s_%d_%s.npz" %(file_hash( pdb ), model_num, READER) )
+    
+    if( os.path.isfile( cache_name ) ):
+        data = dp_model.ModelData.load( cache_name )
+        if( data != None ):
+            return( data )
+    
+    # all atoms are cached, whatever atom set is in use
+    data = read_model_data( pdb, model_num )
+    
+    if( data != None ):
+        # write and rename, other processes may be reading the same entry
+        tmp = temp_name( cache_name )
+        data.save( tmp )
+        os.rename( tmp, cache_name )
+    
+    return( data )
+        
+def show_data(pdb):
+    if( READER == "fast" ):
+        import dp_pdb
+        
+        struct = [data.get_model() for data in dp_pdb.read_models( pdb )]
+    else:
+        struct = pdb_parser().get_structure( "X", pdb )
     
     Msg.out( "PDB '%s' (%d models):\n" %(pdb, len(struct)), False )
     
@@ -6,9 +6,18 @@
 # To create an SVG class start with a 'Scene' object and new items like
 # Circles, Lines, Rectangles and Text. When done just call 'write_svg'  
 #
+# For big drawings use a 'StreamScene' instead: items are written to the
+# file as they are added and 'close' finishes the document.
+#
 # history:
 #    20090825 - 1.0.0 - JAC - first version
 # --------------------------------------------------------------------
+
+import base64
+import shutil
+import struct
+import tempfile
+import zlib
                 
 class Scene:
     def __init__(self, height=400, width=400 ):
@@ -24,28 +33,12 @@ class Scene:
         self.items[key].append(item)
 
     def xml(self):
-        tag_svg = Tag( "svg" )
-        tag_svg.add_attribute( "xmlns", "http://www.w3.org/2000/svg" )
-        tag_svg.add_attribute( "xmlns:xlink", "http://www.w3.org/1999/xlink" )
-        tag_svg.add_attribute( "height", self.height )
-        tag_svg.add_attribute( "width", self.width )
-
-        tag_g = Tag( "g" )
-        tag_g.add_attribute( "style", "fill-opacity:1.0; stroke:black; stroke-width:1;" )
-        
-        tag_svg.add_child( tag_g )
-        
         keys = self.items.keys()
         keys.sort()
         
-        for key in keys:
-            for item in self.items[key]:
-                tag_g.add_child( item.get_tags() )
-
-        var = ""
-        var += tag_svg.xml()
+        body = [item.xml() for key in keys for item in self.items[key]]
         
-        return var
+        return( svg_header( self.height, self.width ) + "".join( body ) + svg_footer() )
 
     def write_svg(self, filename=None, height=None, width=None ):
         if( height != None ):
@@ -61,6 +54,56 @@ class Scene:
         file.write( self.xml() )
         file.close()
 
+#
+# Writes the items straight to the file. Items of the base layer (key 0) go to the file as they are
+# added, items of other layers are spooled to temporary files and appended in key order on 'close'.
+#
+class StreamScene:
+    def __init__(self, filename, height=400, width=400 ):
+        if( not filename.endswith( ".svg" ) ):
+            filename += ".svg"
+        
+        self.file = open( filename, 'w' )
+        self.file.write( svg_header( height, width ) )
+        
+        self.layers = {}
+
+    def add(self,item,key=0):
+        if( key == 0 ):
+            self.file.write( item.xml() )
+        else:
+            if( key < 0 ):
+                raise ValueError( "StreamScene layers must have positive keys" )
+            
+            if( not self.layers.has_key( key ) ):
+                self.layers[key] = tempfile.TemporaryFile()
+            
+            self.layers[key].write( item.xml() )
+
+    def close(self):
+        keys = self.layers.keys()
+        keys.sort()
+        
+        for key in keys:
+            layer = self.layers[key]
+            layer.seek( 0 )
+            shutil.copyfileobj( layer, self.file )
+            layer.close()
+        
+        self.layers = {}
+        
+        self.file.write( svg_footer() )
+        self.file.close()
+
+def svg_header( height, width ):
+    attr_svg = [("xmlns", "http://www.w3.org/2000/svg"), ("xmlns:xlink", "http://www.w3.org/1999/xlink"), ("height", height), ("width", width)]
+    attr_g = [("style", "fill-opacity:1.0; stroke:black; stroke-width:1;")]
+    
+    return( "<svg %s>\n<g %s>\n" %(attributes_str( attr_svg ), attributes_str( attr_g )) )
+
+def svg_footer():
+    return( "</g>\n</svg>\n" )
+
 class Line:
     def __init__(self, start, end, stroke_color="#000000", stroke_width=1):
         self.start = start
@@ -79,6 +122,10 @@ class Line:
         
         return( tag )        
         
+    def xml(self):
+        return( tag_xml( "line", [("x1", self.start[0]), ("y1", self.start[1]), ("x2", self.end[0]), ("y2", self.end[1]),
+                                  ("stroke", self.stroke_color), ("stroke-width", self.stroke_width)] ) )
+
 
 class Circle:
     def __init__(self, center, radius, color):
@@ -95,6 +142,9 @@ class Circle:
         
         return( tag )        
 
+    def xml(self):
+        return( tag_xml( "circle", [("cx", self.center[0]), ("cy", self.center[1]), ("r", self.radius), ("style", "fill:%s;" %self.color)] ) )
+
 class Rectangle:
     def __init__(self,origin,height,width,fill="none",stroke_color="#000000",stroke_width=1):
         self.origin = origin
@@ -116,6 +166,10 @@ class Rectangle:
         
         return( tag )
 
+    def xml(self):
+        return( tag_xml( "rect", [("x", self.origin[0]), ("y", self.origin[1]), ("height", self.height), ("width", self.width),
+                                  ("fill", self.fill), ("stroke", self.stroke_color), ("stroke-width", self.stroke_width)] ) )
+
 class Text:
     def __init__(self,origin,text,size=10,color="#000000"):
         self.origin = origin
@@ -135,6 +189,32 @@ class Text:
         
         return( tag )      
 
+    def xml(self):
+        return( tag_xml( "text", [("x", self.origin[0]), ("y", self.origin[1]), ("font-size", self.size), ("font-weight", "normal"),
+                                  ("font-family", "Verdana"), ("stroke", self.color)], self.text ) )
+
+class Image:
+    def __init__(self,origin,height,width,href):
+        self.origin = origin
+        self.height = height
+        self.width = width
+        self.href = href
+
+    def get_tags(self):
+        tag = Tag( "image" )
+        tag.add_attribute( "x", self.origin[0] )
+        tag.add_attribute( "y", self.origin[1] )
+        tag.add_attribute( "height", self.height )
+        tag.add_attribute( "width", self.width )
+        tag.add_attribute( "preserveAspectRatio", "none" )
+        tag.add_attribute( "style", "image-rendering:optimizeSpeed; image-rendering:pixelated;" )
+        tag.add_attribute( "xlink:href", self.href )
+        
+        return( tag )
+
+    def xml(self):
+        return( self.get_tags().xml() )
+
 class Tag:
     def __init__(self, name):
         self.name = name
@@ -152,26 +232,47 @@ class Tag:
         self.cdata = cdata
         
     def xml(self):
-        child_str = self.cdata
-        attr_str = ""
-        
-        for child in self.children:
-            child_str += child.xml()
-        
-        for attr in self.attributes:
-            if( attr != None ):
-                attr_str += " %s=\"%s\"" %(attr[0], str(attr[1]))
-        
-        if( child_str == "" ):
-            result = "<%s %s/>\n" %(self.name, attr_str)
-        else:
-            result = "<%s %s>\n%s</%s>\n" %(self.name, attr_str, child_str, self.name)
-        
-        return( result )
+        return( tag_xml( self.name, self.attributes, self.cdata, [child.xml() for child in self.children] ) )
+    
+def attributes_str( attributes ):
+    return( "".join( [" %s=\"%s\"" %(attr[0], str(attr[1])) for attr in attributes if attr != None] ) )
+
+def tag_xml( name, attributes, cdata="", children=[] ):
+    child_str = str( cdata ) + "".join( children )
+    
+    if( child_str == "" ):
+        return( "<%s %s/>\n" %(name, attributes_str( attributes )) )
+    else:
+        return( "<%s %s>\n%s</%s>\n" %(name, attributes_str( attributes ), child_str, name) )
     
 def colorstr( r, g, b ):
     return "#%02x%02x%02x" % (r,g,b)
 
+#
+# Encodes an indexed color PNG as a 'data:' URI. 'rows' yields 'height' sequences of 'width' indices
+# into 'colors' (a list of "#rrggbb" strings).
+#
+def png_data_uri( rows, height, width, colors ):
+    def chunk( kind, data ):
+        return( struct.pack( ">I", len(data) ) + kind + data + struct.pack( ">I", zlib.crc32( kind + data ) & 0xffffffff ) )
+    
+    palette = "".join( [chr( int(c[i:i+2], 16) ) for c in colors for i in (1, 3, 5)] )
+    
+    compressor = zlib.compressobj()
+    data = []
+    for row in rows:
+        # filter type 0 + one byte per pixel
+        data.append( compressor.compress( "\0" + "".join( [chr( ndx ) for ndx in row] ) ) )
+    data.append( compressor.flush() )
+    
+    png = "\x89PNG\r\n\x1a\n"
+    png += chunk( "IHDR", struct.pack( ">IIBBBBB", width, height, 8, 3, 0, 0, 0 ) )
+    png += chunk( "PLTE", palette )
+    png += chunk( "IDAT", "".join( data ) )
+    png += chunk( "IEND", "" )
+    
+    return( "data:image/png;base64," + base64.b64encode( png ) )
+
 def test():
     scene = Scene()
     scene.add(Rectangle((100,100),200,200,"#00ffff"))
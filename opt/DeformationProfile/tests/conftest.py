@@ -0,0 +1,47 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+sys.path.insert( 0, ROOT )
+
+EXAMPLE = os.path.join( ROOT, "examples", "ex1" )
+
+#
+# The config file sets module parameters ('dp.Command.apply_settings'), every test starts from the defaults
+#
+@pytest.fixture( autouse=True )
+def settings():
+    import dp_lib
+    import dp_util
+
+    saved = [(module, name, getattr( module, name )) for module in (dp_lib, dp_util, dp_util.Msg)
+             for name in dir( module ) if name.isupper()]
+
+    yield
+
+    for (module, name, value) in saved:
+        setattr( module, name, value )
+
+#
+# Working directory holding the 'a.pdb' (reference) and 'b.pdb' models of example 1
+#
+@pytest.fixture
+def models( tmpdir, monkeypatch ):
+    for name in ("a.pdb", "b.pdb"):
+        shutil.copy( os.path.join( EXAMPLE, name ), str( tmpdir ) )
+
+    monkeypatch.chdir( tmpdir )
+
+    return( tmpdir )
+
+# config file with the given parameters, in the working directory
+def write_config( fname, **params ):
+    fo = open( fname, "w" )
+    for (name, value) in sorted( params.items() ):
+        fo.write( "%s = %r\n" %(name, value) )
+    fo.close()
+
+    return( fname )
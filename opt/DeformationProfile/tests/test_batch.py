@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+import dp
+from conftest import write_config
+
+# model 3 of 'b.pdb' does not exist
+JOBS = [("b.pdb", 0), ("b.pdb", 3), ("a.pdb", 0)]
+
+def batch_config( **params ):
+    os.mkdir( "out" )
+
+    return( write_config( "batch.cfg", ref_model=("a.pdb", 0), cmp_model=JOBS, out_dir="out", svg=False, **params ) )
+
+@pytest.mark.parametrize( "params", [ {},
+                                      {"workers": 2},
+                                      {"manifest": "out/manifest.txt"},
+                                      {"pipeline": True} ] )
+def test_failed_model_exit_status( models, params ):
+    assert dp.main( ["-c", batch_config( **params )] ) == 1
+
+@pytest.mark.parametrize( "params", [ {"workers": 2},
+                                      {"manifest": "out/manifest.txt"},
+                                      {"pipeline": True} ] )
+def test_failed_model_others_compared( models, params ):
+    dp.main( ["-c", batch_config( **params )] )
+
+    assert sorted( os.listdir( "out" ) ) == sorted( ["a.dat", "b.dat"] + ["manifest.txt"] * ("manifest" in params) )
+
+def test_manifest_resume( models, capsys ):
+    cfg = write_config( "batch.cfg", ref_model=("a.pdb", 0), cmp_model=[("b.pdb", 0), ("a.pdb", 0)],
+                        svg=False, manifest="manifest.txt" )
+
+    assert dp.main( ["-c", cfg] ) == 0
+    assert "0 of 2 models already compared" in capsys.readouterr()[1]
+
+    mtime = os.path.getmtime( "b.dat" )
+
+    assert dp.main( ["-c", cfg] ) == 0
+    assert "2 of 2 models already compared" in capsys.readouterr()[1]
+    assert os.path.getmtime( "b.dat" ) == mtime
+
+    # a missing output file is compared again
+    os.remove( "a.dat" )
+
+    assert dp.main( ["-c", cfg] ) == 0
+    assert "1 of 2 models already compared" in capsys.readouterr()[1]
+    assert os.path.isfile( "a.dat" )
+
+def test_usage_exit_status( capsys ):
+    assert dp.main( ["a.pdb"] ) == 1
+    assert "Usage:" in capsys.readouterr()[1]
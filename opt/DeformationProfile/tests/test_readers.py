@@ -0,0 +1,28 @@
+import numpy as np
+
+import dp_api
+import dp_util
+
+def profile( monkeypatch, reader, cache_dir="" ):
+    monkeypatch.setattr( dp_util, "READER", reader )
+    monkeypatch.setattr( dp_util, "CACHE_DIR", cache_dir )
+
+    return( dp_api.compare( "a.pdb", "b.pdb" ) )
+
+def test_fast_reader_same_profile( models, monkeypatch ):
+    bio = profile( monkeypatch, "biopython" )
+    fast = profile( monkeypatch, "fast" )
+
+    assert fast.get_length() == bio.get_length()
+    assert np.allclose( fast.matrix, bio.matrix )
+    assert np.allclose( fast.local_rmsd, bio.local_rmsd )
+
+def test_cache_kept_per_reader( models, monkeypatch ):
+    cache = models.mkdir( "cache" )
+
+    bio = profile( monkeypatch, "biopython", str( cache ) )
+    fast = profile( monkeypatch, "fast", str( cache ) )
+
+    assert len( cache.listdir( "*_biopython.npz" ) ) == 2
+    assert len( cache.listdir( "*_fast.npz" ) ) == 2
+    assert np.allclose( fast.matrix, bio.matrix )
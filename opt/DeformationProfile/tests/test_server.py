@@ -0,0 +1,67 @@
+import json
+import socket
+import threading
+
+import numpy as np
+import pytest
+
+import dp
+import dp_api
+import dp_server
+import dp_util
+from conftest import write_config
+
+@pytest.fixture
+def server( models, monkeypatch ):
+    command = dp.Command()
+    command.parse_input( ["-c", write_config( "server.cfg", ref_model=("a.pdb", 0), band=2 )] )
+    command.apply_settings()
+
+    monkeypatch.setattr( dp_util.Msg, "STDERR_QUIET", True )
+
+    address = str( models.join( "dp.sock" ) )
+
+    srv = dp_server.UnixServer( address, dp_server.Handler )
+    srv.setup_profiles( command )
+
+    thread = threading.Thread( target=srv.serve_forever )
+    thread.daemon = True
+    thread.start()
+
+    yield address
+
+    srv.shutdown()
+    srv.server_close()
+
+def test_query_round_trip( server ):
+    answer = dp_server.query( server, {"cmp": "b.pdb"} )
+
+    expected = dp_api.compare( "a.pdb", "b.pdb" )
+
+    assert answer["status"] == "ok"
+    assert answer["length"] == expected.get_length()
+
+    # cells out of the band come back as null
+    matrix = np.array( [[np.nan if x is None else x for x in row] for row in answer["matrix"]] )
+    assert np.allclose( matrix, np.asarray( expected.matrix, dtype=float ), equal_nan=True )
+    assert np.isnan( matrix[0, -1] )
+
+def test_answer_is_strict_json( server ):
+    sock = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+    sock.connect( server )
+
+    fo = sock.makefile( "rwb" )
+    fo.write( json.dumps( {"cmp": "b.pdb"} ) + "\n" )
+    fo.flush()
+
+    def reject( token ):
+        raise ValueError( token )
+
+    lines = [json.loads( line, parse_constant=reject ) for line in fo]
+    sock.close()
+
+    assert lines[-1] == {"status": "done"}
+
+def test_query_error( server ):
+    with pytest.raises( dp_util.FatalError ):
+        dp_server.query( server, {"cmp": "missing.pdb"} )